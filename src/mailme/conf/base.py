@@ -64,6 +64,13 @@ DATABASES['default']['ATOMIC_REQUESTS'] = True
 # Pool our database connections up for 300 seconds
 DATABASES['default']['CONN_MAX_AGE'] = 300
 
+# Must be shared by all workers, e.g it holds the lock that keeps two
+# workers from syncing the same mailbox and caches IMAP folder lists. The
+# default database cache table is created by a migration.
+CACHES = {
+    'default': env.cache_url('CACHE_URL', default='dbcache://mailme_cache')
+}
+
 
 TEMPLATES = [
     {
@@ -169,13 +176,39 @@ CELERY_TRACK_STARTED = True
 
 CELERY_IMPORTS = (
     'mailme.tasks.mail',
+    'mailme.tasks.sync',
 )
 
 CELERY_QUEUES = (
     Queue('default', routing_key='default'),
     Queue('celery', routing_key='celery'),
+    Queue('idle', routing_key='idle'),
+    Queue('backfill', routing_key='backfill'),
+    Queue('sync', routing_key='sync'),
 )
 
+# Old-style setting name, `config_from_object` reads settings without a
+# namespace.
+CELERY_ROUTES = {
+    # IMAP IDLE listeners block their worker for as long as they run
+    'mailme.tasks.sync.listen_mailbox': {'queue': 'idle', 'routing_key': 'idle'},
+
+    # Low priority, keep it from delaying the sync of new mail
+    'mailme.tasks.sync.backfill_mailbox': {'queue': 'backfill', 'routing_key': 'backfill'},
+
+    # Polls queued by `schedule_syncs`
+    'mailme.tasks.sync.sync_mailbox': {'queue': 'sync', 'routing_key': 'sync'},
+}
+
+CELERYBEAT_SCHEDULE = {
+    # Queues the mailboxes that are due, the polling interval of every
+    # mailbox adapts to how much mail it gets.
+    'schedule-mailbox-syncs': {
+        'task': 'mailme.tasks.sync.schedule_syncs',
+        'schedule': 10.0,
+    },
+}
+
 # Make our `LOGGING` configuration the only truth and don't let celery
 # overwrite it.
 CELERYD_HIJACK_ROOT_LOGGER = False
@@ -185,6 +218,39 @@ CELERYD_HIJACK_ROOT_LOGGER = False
 # want that to be our first-citizen config.
 CELERY_REDIRECT_STDOUTS_LEVEL = 'INFO'
 
+
+## Mail sync
+
+# Keep the inbox of every active mailbox in sync with IMAP IDLE instead of
+# polling it. Every listener blocks a worker process of the `idle` queue,
+# give its worker enough concurrency for all mailboxes, see the Procfile.
+MAILME_IDLE_LISTENERS = env.bool('MAILME_IDLE_LISTENERS', default=False)
+
+# Options of the transports built by `Mailbox.get_connection`, see
+# `ImapTransport` for details.
+
+# Connections used to sync the folders of a mailbox in parallel, capped
+# by the connection limit of the provider.
+MAILME_SYNC_FOLDER_CONNECTIONS = env.int('MAILME_SYNC_FOLDER_CONNECTIONS', default=1)
+
+# Only sync headers and metadata, bodies are downloaded by
+# `fetch_message_bodies` afterwards.
+MAILME_SYNC_HEADERS_FIRST = env.bool('MAILME_SYNC_HEADERS_FIRST', default=False)
+
+# Limit the first sync of a folder to the messages of the last days and/or
+# the newest messages, older ones are backfilled in the background. `None`
+# syncs everything right away.
+MAILME_INITIAL_SYNC_DAYS = env.int('MAILME_INITIAL_SYNC_DAYS', default=None)
+MAILME_INITIAL_SYNC_MESSAGES = env.int('MAILME_INITIAL_SYNC_MESSAGES', default=None)
+
+# Parse messages on a `'thread'` or `'process'` pool while the next ones
+# are fetched, empty to parse in the syncing thread. Process pools need a
+# worker that isn't daemonic, e.g `celery worker -P solo`, prefork
+# workers fall back to threads.
+MAILME_PARSE_EXECUTOR = env('MAILME_PARSE_EXECUTOR', default='thread')
+MAILME_PARSE_WORKERS = env.int('MAILME_PARSE_WORKERS', default=2)
+
+
 # Django security related settings.
 SECURE_SSL_REDIRECT = True
 
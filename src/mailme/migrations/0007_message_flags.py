@@ -0,0 +1,19 @@
+# Generated by Django 2.0.2 on 2026-10-18 08:54
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0006_auto_20180221_0758'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='flags',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=[], verbose_name='Flags'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.0.2 on 2026-10-18 08:57
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0007_message_flags'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='message',
+            unique_together={('folder', 'uid')},
+        ),
+    ]
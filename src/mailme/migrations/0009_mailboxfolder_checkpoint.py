@@ -0,0 +1,23 @@
+# Generated by Django 2.0.2 on 2026-10-18 08:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0008_message_folder_uid_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailboxfolder',
+            name='checkpoint_uid',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mailboxfolder',
+            name='pending_uids',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
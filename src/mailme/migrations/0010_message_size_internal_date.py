@@ -0,0 +1,23 @@
+# Generated by Django 2.0.2 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0009_mailboxfolder_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='internal_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.2 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0010_message_size_internal_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='body_fetched',
+            field=models.BooleanField(default=True),
+        ),
+    ]
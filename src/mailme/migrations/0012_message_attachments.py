@@ -0,0 +1,19 @@
+# Generated by Django 2.0.2 on 2026-10-18 09:09
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0011_message_body_fetched'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='attachments',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=[], verbose_name='Attachments'),
+        ),
+    ]
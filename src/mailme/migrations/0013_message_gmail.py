@@ -0,0 +1,29 @@
+# Generated by Django 2.0.2 on 2026-10-18 09:11
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0012_message_attachments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='gm_msgid',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='gm_thrid',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='labels',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=[], verbose_name='Labels'),
+        ),
+    ]
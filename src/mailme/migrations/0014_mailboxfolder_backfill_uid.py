@@ -0,0 +1,18 @@
+# Generated by Django 2.0.2 on 2026-10-18 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0013_message_gmail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailboxfolder',
+            name='backfill_uid',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
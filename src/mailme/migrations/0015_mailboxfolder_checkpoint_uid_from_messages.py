@@ -0,0 +1,27 @@
+# Generated by Django 2.0.2 on 2026-10-18 09:15
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def set_checkpoint_uid(apps, schema_editor):
+    # The sync no longer falls back to the highest stored UID
+    MailboxFolder = apps.get_model('mailme', 'MailboxFolder')
+    Message = apps.get_model('mailme', 'Message')
+
+    highest_uid = Message.objects.filter(
+        folder=OuterRef('pk')).order_by('-uid').values('uid')[:1]
+
+    MailboxFolder.objects.filter(checkpoint_uid__isnull=True).update(
+        checkpoint_uid=Subquery(highest_uid))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0014_mailboxfolder_backfill_uid'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_checkpoint_uid, migrations.RunPython.noop),
+    ]
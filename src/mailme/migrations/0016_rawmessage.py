@@ -0,0 +1,37 @@
+# Generated by Django 2.0.2 on 2026-10-18 09:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0015_mailboxfolder_checkpoint_uid_from_messages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RawMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.CharField(max_length=998)),
+                ('body_hash', models.CharField(max_length=64)),
+                ('body', models.TextField(verbose_name='Raw body')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='original',
+            field=models.TextField(blank=True, verbose_name='Original (raw) text'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='rawmessage',
+            unique_together={('message_id', 'body_hash')},
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='raw',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='mailme.RawMessage'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.0.2 on 2026-10-18 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0016_rawmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailbox',
+            name='next_sync_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mailbox',
+            name='sync_failures',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mailbox',
+            name='sync_interval',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.0.2 on 2026-10-18 09:39
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    # Does nothing unless `CACHES` uses the database cache
+    call_command('createcachetable', database=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailme', '0017_mailbox_sync_schedule'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import re
+from collections import OrderedDict
+
 import pytz
 
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, UserManager
 from django.contrib.postgres.fields import JSONField
-from django.db import models
+from django.db import connections, models
 from django.utils import timezone
+from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _
 from django.utils.functional import cached_property
 
@@ -84,6 +90,15 @@ class MailboxFolder(models.Model):
     highestmodseq = models.BigIntegerField(null=True, blank=True)
     uidnext = models.PositiveIntegerField(null=True, blank=True)
 
+    # Resumable syncs, the highest UID up to which all messages are stored
+    # and the UIDs (as IMAP sequence set) that still need to be fetched.
+    checkpoint_uid = models.BigIntegerField(null=True, blank=True)
+    pending_uids = models.TextField(blank=True, default='')
+
+    # Newest-first initial syncs, all messages up to this UID still have
+    # to be backfilled.
+    backfill_uid = models.BigIntegerField(null=True, blank=True)
+
 
 class Mailbox(models.Model):
     name = models.CharField(_(u'Name'), max_length=256)
@@ -103,6 +118,11 @@ class Mailbox(models.Model):
 
     active = models.BooleanField(_(u'Active'), blank=True, default=True)
 
+    # Polling schedule, see `mailme.tasks.sync.schedule_next_sync`
+    next_sync_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    sync_interval = models.PositiveIntegerField(null=True, blank=True)
+    sync_failures = models.PositiveIntegerField(default=0)
+
     objects = models.Manager()
 
     @cached_property
@@ -121,61 +141,245 @@ class Mailbox(models.Model):
             return None
 
         # Circular imports
+        from .transports.base import get_parse_executor
+        from .transports.gmail import GmailTransport, is_gmail
         from .transports.imap import ImapTransport
 
-        uri = self.parsed_uri
+        if self.parsed_uri.scheme != 'imap':
+            return None
 
-        if uri.scheme == 'imap':
-            conn = ImapTransport(
-                uri.location,
-                ssl=uri.use_ssl,
-                mailbox=self,
-            )
-            conn.connect(uri.username, uri.password)
-        return conn
+        transport_class = GmailTransport if is_gmail(self) else ImapTransport
+        transport = transport_class(self.uri, mailbox=self)
+        transport.folder_connections = settings.MAILME_SYNC_FOLDER_CONNECTIONS
+        transport.headers_first = settings.MAILME_SYNC_HEADERS_FIRST
+        transport.initial_sync_days = settings.MAILME_INITIAL_SYNC_DAYS
+        transport.initial_sync_messages = settings.MAILME_INITIAL_SYNC_MESSAGES
 
-    def sync(self, condition=None, folder=None):
-        """Connect to this transport and fetch new messages."""
-        new_mail = []
-        connection = self.get_connection()
-        if not connection:
-            return new_mail
+        if settings.MAILME_PARSE_EXECUTOR:
+            transport.parse_executor = get_parse_executor(
+                settings.MAILME_PARSE_EXECUTOR, settings.MAILME_PARSE_WORKERS)
 
-        messages = connection.get_messages(condition=condition, folder=folder)
+        return transport
 
-        # TODO:
-        # * handle attachments
-        # * normalize html
+    def sync(self, heartbeat=None, skip_folders=()):
+        """Connect to this transport and fetch new messages.
 
-        for message in messages:
-            date = message['parsed_date']
-
-            if timezone.is_naive(date):
-                # If no timezone is given, UTC should be used
-                date = timezone.make_aware(date, pytz.UTC)
-
-            new_mail.append(Message(
-                message_id=message['message_id'],
-                original=message['original'],
-                date=date,
-                subject=message['subject'],
-                plain_body=message['body']['plain'],
-                html_body=message['body']['html'],
-                sent_from=message['from'],
-                to=message['to'],
-                bcc=message['bcc'],
-                cc=message['cc'],
-                headers=message['headers'],
-            ))
-
-        Message.objects.bulk_create(new_mail)
-
-        return new_mail
+        `heartbeat` is called regularly while the sync makes progress,
+        folders named in `skip_folders` aren't synced. Returns the
+        transport, e.g for its `stored_messages`, or `None` if the mailbox
+        can't be synced.
+        """
+        connection = self.get_connection()
+
+        if connection is None:
+            return None
+
+        connection.heartbeat = heartbeat
+        connection.skip_folders = frozenset(skip_folders)
+        connection.sync()
+        return connection
 
     def __str__(self):
         return self.name
 
 
+class MessageQuerySet(models.QuerySet):
+
+    def delete_with_raw(self):
+        """Delete the messages and the raw bodies no other copy links to."""
+        raw_ids = set(self.exclude(raw=None).values_list('raw_id', flat=True))
+        deleted = self.delete()
+
+        if raw_ids:
+            RawMessage.objects.delete_orphans(raw_ids)
+
+        return deleted
+
+    def upsert(self, messages, batch_size=500, update_fields=None):
+        """Insert `messages`, updating the ones that are already stored.
+
+        Every batch is written with a single multi-row
+        ``INSERT ... ON CONFLICT (folder_id, uid) DO UPDATE`` so that
+        re-running a sync for the same messages is idempotent. Only the
+        `update_fields` of stored messages are updated if given.
+        """
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+
+        fields = [
+            field for field in self.model._meta.concrete_fields
+            if not field.primary_key]
+        columns = [field.column for field in fields]
+        conflict_columns = ('folder_id', 'uid')
+
+        placeholder = '({})'.format(', '.join(['%s'] * len(fields)))
+        updates = ', '.join(
+            '{0} = EXCLUDED.{0}'.format(quote_name(field.column))
+            for field in fields
+            if field.column not in conflict_columns and (
+                update_fields is None or field.name in update_fields))
+
+        # A row can't be affected twice by the same statement, keep the
+        # last version of every message.
+        messages = list(OrderedDict(
+            ((message.folder_id, message.uid), message)
+            for message in messages).values())
+
+        with connection.cursor() as cursor:
+            for offset in range(0, len(messages), batch_size):
+                batch = messages[offset:offset + batch_size]
+                params = []
+
+                for message in batch:
+                    params.extend(
+                        field.get_db_prep_save(
+                            field.pre_save(message, True), connection)
+                        for field in fields)
+
+                cursor.execute(
+                    'INSERT INTO {table} ({columns}) VALUES {values} '
+                    'ON CONFLICT ({conflict}) DO UPDATE SET {updates}'.format(
+                        table=quote_name(self.model._meta.db_table),
+                        columns=', '.join(quote_name(c) for c in columns),
+                        values=', '.join([placeholder] * len(batch)),
+                        conflict=', '.join(conflict_columns),
+                        updates=updates),
+                    params)
+
+
+RE_HEADER_END = re.compile(r'\r?\n\r?\n')
+
+
+def normalize_message_id(value):
+    """Strip whitespace and angle brackets, ``<ID@Host>`` -> ``id@host``."""
+    return (value or '').strip().strip('<>').strip().lower()
+
+
+def split_original(original):
+    """Split a raw message into its header block and its body."""
+    match = RE_HEADER_END.search(original)
+
+    if match is None:
+        return original, ''
+
+    return original[:match.end()], original[match.end():]
+
+
+def get_body_hash(body):
+    return hashlib.sha256(body.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def get_raw_message_key(message_id, body_hash):
+    return f'{message_id}\x00{body_hash}'
+
+
+class RawMessageQuerySet(models.QuerySet):
+
+    def deduplicate(self, messages, seen=None):
+        """Store the raw body of `messages` only once and link them to it.
+
+        Messages are identified by their normalized Message-ID and body
+        hash, copies in other folders or mailboxes share the same
+        `RawMessage`. The headers differ between copies (Received,
+        Delivered-To, Bcc...) and stay in the `original` of every message.
+        Messages without Message-ID or body, e.g with only their headers
+        synced, keep their whole `original`.
+
+        `seen` is a `BloomFilter` of the keys that might already be stored,
+        keys it doesn't contain are inserted without being looked up first.
+        It's updated with the keys of `messages`.
+        """
+        keyed = OrderedDict()
+        bodies = {}
+
+        for message in messages:
+            message_id = normalize_message_id(message.message_id)
+
+            if not message_id or not message.body_fetched:
+                continue
+
+            message.original, body = split_original(message.original)
+
+            if not body:
+                # E.g only the text parts were fetched, nothing to share
+                continue
+
+            key = (message_id, get_body_hash(body))
+            keyed.setdefault(key, []).append(message)
+            bodies[key] = body
+
+        if not keyed:
+            return
+
+        ids = {}
+        maybe_stored = [
+            key for key in keyed
+            if seen is None or get_raw_message_key(*key) in seen]
+
+        if maybe_stored:
+            stored = self.filter(
+                message_id__in={message_id for message_id, _ in maybe_stored}
+            ).values_list('pk', 'message_id', 'body_hash')
+            ids.update(((message_id, body_hash), pk) for pk, message_id, body_hash in stored)
+
+        missing = [key for key in keyed if key not in ids]
+
+        if missing:
+            ids.update(self._insert_missing((key, bodies[key]) for key in missing))
+
+        for key, key_messages in keyed.items():
+            for message in key_messages:
+                message.raw_id = ids[key]
+
+            if seen is not None:
+                seen.add(get_raw_message_key(*key))
+
+    def delete_orphans(self, pks):
+        """Delete the raw messages of `pks` that no message links to anymore."""
+        return self.filter(pk__in=pks, messages__isnull=True).delete()
+
+    def _insert_missing(self, rows):
+        # Another sync (of a different mailbox) may have stored some of them
+        # in the meantime, the no-op update makes RETURNING include those.
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        params = []
+
+        for (message_id, body_hash), body in rows:
+            params.extend((message_id, body_hash, body))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} (message_id, body_hash, body) VALUES {values} '
+                'ON CONFLICT (message_id, body_hash) '
+                'DO UPDATE SET message_id = EXCLUDED.message_id '
+                'RETURNING id, message_id, body_hash'.format(
+                    table=quote_name(self.model._meta.db_table),
+                    values=', '.join(['(%s, %s, %s)'] * (len(params) // 3))),
+                params)
+
+            return {(message_id, body_hash): pk for pk, message_id, body_hash in cursor}
+
+
+class RawMessage(models.Model):
+    """The raw body of a message, shared by all its copies."""
+    message_id = models.CharField(max_length=998)
+    body_hash = models.CharField(max_length=64)
+    body = models.TextField(_('Raw body'))
+
+    objects = RawMessageQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (('message_id', 'body_hash'),)
+
+    def __repr__(self):
+        return f'<RawMessage({self.message_id})>'
+
+
+# Filled in by `ImapTransport.fetch_bodies` after a headers-first sync
+MESSAGE_BODY_FIELDS = ('original', 'plain_body', 'html_body', 'body_fetched', 'raw')
+
+
 class Message(models.Model):
     folder = models.ForeignKey(
         MailboxFolder, related_name='messages', on_delete=models.PROTECT)
@@ -189,7 +393,7 @@ class Message(models.Model):
 
     headers = JSONField(_('Headers'), blank=True, default={})
     subject = models.CharField(_('Subject'), max_length=255)
-    original = models.TextField(_('Original (raw) text'))
+    original = models.TextField(_('Original (raw) text'), blank=True)
     plain_body = models.TextField(_('Text'), blank=True)
     html_body = models.TextField(_('HTML'), blank=True)
     date = models.DateTimeField(_('Date'), blank=True)
@@ -200,9 +404,88 @@ class Message(models.Model):
 
     # Imap sync related metadata
     uid = models.BigIntegerField(db_index=True)
+    flags = JSONField(_('Flags'), blank=True, default=[])
+    size = models.PositiveIntegerField(null=True, blank=True)
+    internal_date = models.DateTimeField(null=True, blank=True)
+
+    # `False` if only the headers were synced so far
+    body_fetched = models.BooleanField(default=True)
+
+    # Part metadata (section, content type, size, filename...) of everything
+    # but the text bodies, see `ImapTransport.fetch_attachment`
+    attachments = JSONField(_('Attachments'), blank=True, default=[])
+
+    # Gmail specific, see `GmailTransport`
+    gm_msgid = models.BigIntegerField(null=True, blank=True, db_index=True)
+    gm_thrid = models.BigIntegerField(null=True, blank=True)
+    labels = JSONField(_('Labels'), blank=True, default=[])
+
+    # Set if the body is stored once for all copies of the message,
+    # `original` only holds the headers then. See
+    # `RawMessageQuerySet.deduplicate`.
+    raw = models.ForeignKey(
+        RawMessage, related_name='messages', null=True, blank=True,
+        on_delete=models.PROTECT)
+
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (('folder', 'uid'),)
 
     def __str__(self):
         return self.subject
 
+    def get_original(self):
+        if self.raw_id:
+            return self.original + self.raw.body
+        return self.original
+
+    def fetch_body(self):
+        """Download the body if only the headers were synced so far."""
+        if self.body_fetched:
+            return
+
+        transport = self.folder.mailbox.get_connection()
+
+        try:
+            transport.fetch_bodies(self.folder, [self.uid])
+        finally:
+            transport.close()
+
+        self.refresh_from_db()
+
+    @classmethod
+    def from_parsed(cls, parsed, **kwargs):
+        """Build a (not yet saved) message from a `parse_email` result."""
+        date = parsed.get('parsed_date') or timezone.now()
+
+        if timezone.is_naive(date):
+            # If no timezone is given, UTC should be used
+            date = timezone.make_aware(date, pytz.UTC)
+
+        def join_body(parts):
+            return '\n'.join(force_text(part, errors='replace') for part in parts)
+
+        # PostgreSQL doesn't allow NUL characters in text columns
+        original = parsed.get('original', '').replace('\x00', '')
+
+        # TODO:
+        # * handle attachments
+        # * normalize html
+        return cls(
+            message_id=parsed.get('message_id', ''),
+            original=original,
+            date=date,
+            subject=parsed.get('subject', '')[:255],
+            plain_body=join_body(parsed['body']['plain']),
+            html_body=join_body(parsed['body']['html']),
+            from_address=parsed['from'],
+            to_address=parsed['to'],
+            cc_address=parsed['cc'],
+            bcc_address=parsed['bcc'],
+            headers=parsed['headers'],
+            **kwargs
+        )
+
     def __repr__(self):
         return f'<Message({self.subject})>'
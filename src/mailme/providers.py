@@ -266,6 +266,7 @@ PROVIDERS = dict([
         'imap': ('imap.mail.yahoo.com', 993),
         'smtp': ('smtp.mail.yahoo.com', 587),
         'auth': 'password',
+        'max_connections': 5,
         'domains': ['yahoo.com.ar', 'yahoo.com.au', 'yahoo.at', 'yahoo.be',
                     'yahoo.fr', 'yahoo.be', 'yahoo.nl', 'yahoo.com.br',
                     'yahoo.ca', 'yahoo.en', 'yahoo.ca', 'yahoo.fr',
@@ -395,6 +396,8 @@ PROVIDERS = dict([
         'imap': ('imap.gmail.com', 993),
         'smtp': ('smtp.gmail.com', 587),
         'auth': 'oauth2',
+        # Simultaneous IMAP connections allowed per account
+        'max_connections': 15,
         'events': True,
         'contacts': True,
         'mx_servers': ['aspmx.l.google.com',
@@ -0,0 +1,359 @@
+import random
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Q
+from django.utils import timezone
+from imapclient.exceptions import IMAPClientError
+
+from mailme.models import Mailbox
+from mailme.tasks import celery
+from mailme.transports.idle import ImapIdleListener
+from mailme.transports.imap import DEFAULT_POLL_FREQUENCY
+from mailme.utils.logging import logged
+
+
+# Pause between two backfill batches of a mailbox
+BACKFILL_INTERVAL = 60
+
+# Polling intervals in seconds. Mailboxes that just got mail are polled
+# every `MIN_SYNC_INTERVAL`, the interval doubles with every sync without
+# new mail up to `MAX_SYNC_INTERVAL` and with every failed sync up to
+# `MAX_RETRY_INTERVAL`. Intervals are spread by +/- `SYNC_JITTER` so that
+# mailboxes added at the same time don't stay in lockstep.
+MIN_SYNC_INTERVAL = DEFAULT_POLL_FREQUENCY
+MAX_SYNC_INTERVAL = 15 * 60
+MAX_RETRY_INTERVAL = 6 * 60 * 60
+SYNC_BACKOFF = 2
+SYNC_JITTER = 0.1
+
+# Maximum number of syncs queued by a single `schedule_syncs` run
+SCHEDULE_BATCH_SIZE = 1000
+
+# Held while a mailbox is synced, needs a cache shared by all workers.
+# Extended by every stored chunk, so it only expires if a sync hangs or
+# its worker died. Also how long a queued sync may take to start before
+# it's queued again.
+SYNC_LOCK_KEY = 'mailme:sync:lock:{}'
+SYNC_LOCK_TIMEOUT = 30 * 60
+
+# Delay before a task that found its mailbox locked runs again
+LOCK_RETRY_INTERVAL = 60
+
+# Set while an IDLE listener is queued or runs for a mailbox, holds the
+# name of the folder it listens on. Refreshed by the listener, so that it
+# expires if the listener died. Mailboxes that can't be listened to are
+# marked for `LISTENER_UNSUPPORTED_TIMEOUT` instead.
+LISTENER_KEY = 'mailme:idle:listener:{}'
+LISTENER_TIMEOUT = 10 * 60
+LISTENER_UNSUPPORTED_TIMEOUT = 24 * 60 * 60
+
+
+class SyncLockLost(Exception):
+    pass
+
+
+class SyncLock(object):
+    """Lock a mailbox in the cache while it's synced.
+
+    Every holder has a token of its own, a lock is only extended or
+    released by the holder that acquired it.
+    """
+
+    def __init__(self, mailbox_id):
+        self.key = SYNC_LOCK_KEY.format(mailbox_id)
+        self.token = uuid.uuid4().hex
+
+    def acquire(self):
+        return cache.add(self.key, self.token, SYNC_LOCK_TIMEOUT)
+
+    def refresh(self):
+        """Extend the lock, raises `SyncLockLost` if it expired meanwhile."""
+        if cache.get(self.key) != self.token and not self.acquire():
+            raise SyncLockLost(self.key)
+
+        cache.set(self.key, self.token, SYNC_LOCK_TIMEOUT)
+
+    def release(self):
+        if cache.get(self.key) == self.token:
+            cache.delete(self.key)
+
+
+def acquire_or_requeue(task, mailbox_id):
+    """Return the acquired `SyncLock` of a mailbox for `task`.
+
+    Returns `None` if the mailbox is locked, `task` is queued again for
+    `LOCK_RETRY_INTERVAL` seconds later then.
+    """
+    lock = SyncLock(mailbox_id)
+
+    if lock.acquire():
+        return lock
+
+    task.logger.info('Mailbox %r is locked, retrying %s later.', mailbox_id, task.name)
+    task.apply_async((mailbox_id,), countdown=LOCK_RETRY_INTERVAL)
+    return None
+
+
+def get_listened_folder(mailbox_id):
+    """Return the name of the folder an IDLE listener keeps in sync, if any."""
+    if not settings.MAILME_IDLE_LISTENERS:
+        return None
+
+    listener = cache.get(LISTENER_KEY.format(mailbox_id))
+    return listener['folder'] if listener else None
+
+
+def get_sync_interval(mailbox, stored_messages=0, failed=False):
+    """Return the seconds until the next sync of `mailbox`, without jitter."""
+    if failed:
+        return min(
+            MIN_SYNC_INTERVAL * SYNC_BACKOFF ** (mailbox.sync_failures + 1),
+            MAX_RETRY_INTERVAL)
+
+    if stored_messages:
+        return MIN_SYNC_INTERVAL
+
+    return min(
+        (mailbox.sync_interval or MIN_SYNC_INTERVAL) * SYNC_BACKOFF,
+        MAX_SYNC_INTERVAL)
+
+
+def schedule_next_sync(mailbox, stored_messages=0, failed=False):
+    """Set when `mailbox` is synced next, based on the outcome of a sync."""
+    interval = get_sync_interval(mailbox, stored_messages, failed)
+
+    mailbox.sync_failures = mailbox.sync_failures + 1 if failed else 0
+    mailbox.sync_interval = interval
+    mailbox.next_sync_at = timezone.now() + timedelta(
+        seconds=interval * random.uniform(1 - SYNC_JITTER, 1 + SYNC_JITTER))
+
+    Mailbox.objects.filter(pk=mailbox.pk).update(
+        sync_failures=mailbox.sync_failures,
+        sync_interval=mailbox.sync_interval,
+        next_sync_at=mailbox.next_sync_at)
+
+
+@logged
+@celery.task(ignore_result=True)
+def schedule_syncs():
+    """Queue `sync_mailbox` for every active mailbox that is due.
+
+    Runs periodically from celery beat, see `CELERYBEAT_SCHEDULE`. Queued
+    mailboxes are pushed back by `SYNC_LOCK_TIMEOUT` so that they aren't
+    queued again before their sync ran and scheduled the next one.
+
+    With `MAILME_IDLE_LISTENERS` a `listen_mailbox` is queued as well for
+    due mailboxes without a listener.
+    """
+    now = timezone.now()
+
+    due = list(
+        Mailbox.objects
+        .filter(active=True, uri__isnull=False)
+        .filter(Q(next_sync_at__isnull=True) | Q(next_sync_at__lte=now))
+        .order_by(F('next_sync_at').asc(nulls_first=True))
+        .values_list('pk', flat=True)[:SCHEDULE_BATCH_SIZE])
+
+    Mailbox.objects.filter(pk__in=due).update(
+        next_sync_at=now + timedelta(seconds=SYNC_LOCK_TIMEOUT))
+
+    for mailbox_id in due:
+        sync_mailbox.delay(mailbox_id)
+
+        if settings.MAILME_IDLE_LISTENERS and cache.add(
+                LISTENER_KEY.format(mailbox_id), {'token': None, 'folder': None},
+                LISTENER_TIMEOUT):
+            listen_mailbox.delay(mailbox_id)
+
+    if due:
+        schedule_syncs.logger.info('Queued %d mailbox syncs.', len(due))
+
+
+@logged
+@celery.task(ignore_result=True, bind=True)
+def sync_mailbox(self, mailbox_id):
+    """Sync a mailbox and schedule its next sync.
+
+    Skipped if another worker is still syncing the same mailbox. Body
+    downloads and backfills the sync left to do are queued once the lock
+    is released. The folder kept in sync by an IDLE listener is left out.
+    """
+    lock = SyncLock(mailbox_id)
+
+    if not lock.acquire():
+        self.logger.info('Mailbox %r is already being synced, skipping.', mailbox_id)
+        return
+
+    try:
+        mailbox = Mailbox.objects.get(pk=mailbox_id)
+        listened_folder = get_listened_folder(mailbox_id)
+
+        try:
+            transport = mailbox.sync(
+                heartbeat=lock.refresh,
+                skip_folders=[listened_folder] if listened_folder else ())
+        except SyncLockLost:
+            # Another worker syncs the mailbox now and schedules the next sync
+            self.logger.warning(
+                'Lost the sync lock of mailbox %r, stopping.', mailbox_id)
+            return
+        except Exception:
+            schedule_next_sync(mailbox, failed=True)
+            raise
+    finally:
+        lock.release()
+
+    if transport is None:
+        schedule_next_sync(mailbox)
+        return
+
+    schedule_next_sync(mailbox, transport.stored_messages)
+
+    if transport.stored_messages and getattr(transport, 'headers_first', False):
+        fetch_message_bodies.delay(mailbox_id)
+
+    if getattr(transport, 'backfill_pending', False):
+        backfill_mailbox.delay(mailbox_id)
+
+
+@logged
+@celery.task(ignore_result=True, bind=True)
+def listen_mailbox(self, mailbox_id):
+    """Keep the inbox of a mailbox in sync using IMAP IDLE.
+
+    This blocks for as long as the connection stays alive, make sure to
+    route it to a dedicated queue. Queued by `schedule_syncs`, polls of the
+    mailbox leave the inbox out while the listener is registered under
+    `LISTENER_KEY`. Every sync of the inbox holds the sync lock.
+    """
+    key = LISTENER_KEY.format(mailbox_id)
+    token = uuid.uuid4().hex
+    mailbox = Mailbox.objects.get(pk=mailbox_id)
+    transport = mailbox.get_connection() if mailbox.active else None
+
+    if transport is None:
+        cache.delete(key)
+        return
+
+    listener = ImapIdleListener(transport, lock=SyncLock(mailbox_id))
+
+    def heartbeat():
+        current = cache.get(key)
+
+        if current is not None and current['token'] not in (None, token):
+            # Replaced by another listener, e.g after our key expired
+            listener.stop()
+            return
+
+        cache.set(key, {
+            'token': token,
+            'folder': listener.folder.name if listener.folder else None,
+        }, LISTENER_TIMEOUT)
+
+    listener.heartbeat = heartbeat
+    heartbeat()
+
+    try:
+        listening = listener.listen()
+    except (IMAPClientError, OSError, SyncLockLost) as exc:
+        transport.close(discard=True)
+        self.logger.warning(
+            'Lost IDLE connection for mailbox %r, retrying.', mailbox_id)
+
+        # Stays registered until the retry takes over or the key expires
+        self.retry(exc=exc, countdown=DEFAULT_POLL_FREQUENCY)
+
+    transport.close()
+
+    if cache.get(key, {}).get('token') in (None, token):
+        if listening:
+            cache.delete(key)
+        else:
+            # Polled as usual, don't queue another listener soon
+            cache.set(
+                key, {'token': token, 'folder': None}, LISTENER_UNSUPPORTED_TIMEOUT)
+
+
+@logged
+@celery.task(ignore_result=True, bind=True)
+def fetch_message_bodies(self, mailbox_id):
+    """Download the bodies of messages stored by a headers-first sync.
+
+    Holds the sync lock of the mailbox, re-queued if it's locked.
+    """
+    lock = acquire_or_requeue(self, mailbox_id)
+
+    if lock is None:
+        return
+
+    try:
+        mailbox = Mailbox.objects.get(pk=mailbox_id)
+        transport = mailbox.get_connection()
+
+        if transport is None:
+            return
+
+        transport.heartbeat = lock.refresh
+        folders = mailbox.folders.filter(messages__body_fetched=False).distinct()
+
+        try:
+            for folder in folders:
+                transport.fetch_bodies(folder)
+        except SyncLockLost:
+            self.logger.warning(
+                'Lost the sync lock of mailbox %r, stopping.', mailbox_id)
+        except Exception:
+            transport.close(discard=True)
+            raise
+
+        transport.close()
+    finally:
+        lock.release()
+
+
+@logged
+@celery.task(ignore_result=True, bind=True)
+def backfill_mailbox(self, mailbox_id):
+    """Fetch older messages left out by a newest-first initial sync.
+
+    Fetches one batch per folder and re-queues itself until everything is
+    stored, this is routed to the `backfill` queue so that it can be
+    throttled independently of new mail. Holds the sync lock of the
+    mailbox, re-queued if it's locked.
+    """
+    lock = acquire_or_requeue(self, mailbox_id)
+
+    if lock is None:
+        return
+
+    try:
+        mailbox = Mailbox.objects.get(pk=mailbox_id)
+        transport = mailbox.get_connection()
+
+        if transport is None:
+            return
+
+        transport.heartbeat = lock.refresh
+        folders = mailbox.folders.filter(backfill_uid__isnull=False)
+
+        try:
+            pending = [transport.backfill_folder(folder) for folder in folders]
+        except SyncLockLost:
+            # Whoever holds the lock now queues the next batch if needed
+            self.logger.warning(
+                'Lost the sync lock of mailbox %r, stopping.', mailbox_id)
+            transport.close()
+            return
+        except Exception:
+            transport.close(discard=True)
+            raise
+
+        transport.close()
+    finally:
+        lock.release()
+
+    if any(pending):
+        backfill_mailbox.apply_async((mailbox_id,), countdown=BACKFILL_INTERVAL)
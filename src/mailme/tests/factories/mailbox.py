@@ -1,6 +1,7 @@
 import factory
+from django.utils import timezone
 
-from mailme.models import Mailbox
+from mailme.models import Mailbox, MailboxFolder, Message
 from mailme.tests.factories.user import UserFactory
 
 
@@ -11,3 +12,23 @@ class MailboxFactory(factory.DjangoModelFactory):
 
     class Meta:
         model = Mailbox
+
+
+class MailboxFolderFactory(factory.DjangoModelFactory):
+    mailbox = factory.SubFactory(MailboxFactory)
+    name = 'INBOX'
+
+    class Meta:
+        model = MailboxFolder
+
+
+class MessageFactory(factory.DjangoModelFactory):
+    folder = factory.SubFactory(MailboxFolderFactory)
+    subject = 'Test message'
+    original = ''
+    date = factory.LazyFunction(timezone.now)
+    message_id = factory.Sequence(lambda idx: f'<{idx}@mailme.test>')
+    uid = factory.Sequence(lambda idx: idx + 1)
+
+    class Meta:
+        model = Message
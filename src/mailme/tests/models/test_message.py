@@ -0,0 +1,136 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from mailme.models import Message, RawMessage
+from mailme.tests.factories.mailbox import MailboxFolderFactory, MessageFactory
+from mailme.utils.bloom import BloomFilter
+from mailme.utils.parser import parse_email
+
+
+@pytest.mark.django_db
+class TestMessageModel:
+
+    def setup(self):
+        self.folder = MailboxFolderFactory.create()
+
+    def test_from_parsed(self):
+        parsed = parse_email(
+            'Subject: Hello\nMessage-ID: <1@mailme.test>\n'
+            'From: John Doe <johndoe@gmail.com>\n\nBody')
+
+        message = Message.from_parsed(parsed, folder=self.folder, uid=1)
+
+        assert message.subject == 'Hello'
+        assert message.message_id == '<1@mailme.test>'
+        assert message.plain_body == 'Body'
+        assert message.from_address == [
+            {'name': 'John Doe', 'email': 'johndoe@gmail.com'}]
+        assert message.date is not None
+
+    def test_upsert(self):
+        MessageFactory.create(folder=self.folder, uid=1, subject='old')
+
+        Message.objects.upsert([
+            MessageFactory.build(folder=self.folder, uid=1, subject='new'),
+            MessageFactory.build(folder=self.folder, uid=2),
+            MessageFactory.build(folder=self.folder, uid=3),
+        ], batch_size=2)
+
+        assert self.folder.messages.count() == 3
+        assert self.folder.messages.get(uid=1).subject == 'new'
+
+    def test_upsert_is_idempotent(self):
+        messages = [
+            MessageFactory.build(folder=self.folder, uid=uid)
+            for uid in (1, 2, 1)]
+
+        Message.objects.upsert(messages)
+        Message.objects.upsert(messages)
+
+        assert self.folder.messages.count() == 2
+
+    def test_deduplicate(self):
+        other_folder = MailboxFolderFactory.create()
+        original = 'Message-ID: <1@mailme.test>\r\n\r\nBody'
+
+        messages = [
+            MessageFactory.build(
+                folder=self.folder, uid=1, message_id='<1@mailme.test>',
+                original=original),
+            MessageFactory.build(
+                folder=other_folder, uid=1, message_id=' <1@Mailme.test>',
+                original='Received: elsewhere\r\n' + original),
+            # Same Message-ID but a different body
+            MessageFactory.build(
+                folder=self.folder, uid=2, message_id='<1@mailme.test>',
+                original=original + ' changed'),
+            MessageFactory.build(
+                folder=self.folder, uid=3, message_id='', original=original),
+        ]
+
+        RawMessage.objects.deduplicate(messages)
+        Message.objects.upsert(messages)
+
+        assert RawMessage.objects.count() == 2
+        assert messages[0].raw_id == messages[1].raw_id != messages[2].raw_id
+        assert messages[3].raw_id is None
+
+        # Only the body is shared, every copy keeps its own headers
+        assert RawMessage.objects.get(pk=messages[0].raw_id).body == 'Body'
+
+        stored = Message.objects.get(folder=other_folder, uid=1)
+        assert stored.original == 'Received: elsewhere\r\nMessage-ID: <1@mailme.test>\r\n\r\n'
+        assert stored.get_original() == 'Received: elsewhere\r\n' + original
+        assert self.folder.messages.get(uid=1).get_original() == original
+        assert self.folder.messages.get(uid=3).get_original() == original
+
+    def test_deduplicate_skips_lookup_of_unseen_keys(self):
+        seen = BloomFilter()
+        messages = [
+            MessageFactory.build(
+                folder=self.folder, uid=uid, message_id=f'<{uid}@mailme.test>',
+                original='Subject: test\r\n\r\nBody')
+            for uid in (1, 2)]
+
+        with CaptureQueriesContext(connection) as queries:
+            RawMessage.objects.deduplicate(messages, seen=seen)
+
+        # Only the insert, no lookup
+        assert len(queries) == 1
+
+        assert len(seen) == 2
+
+        copies = [
+            MessageFactory.build(
+                folder=self.folder, uid=uid + 2, message_id=message.message_id,
+                original='Subject: test\r\n\r\nBody')
+            for uid, message in zip((1, 2), messages)]
+
+        with CaptureQueriesContext(connection) as queries:
+            RawMessage.objects.deduplicate(copies, seen=seen)
+
+        # Copies are looked up and not inserted again
+        assert len(queries) == 1
+
+        assert [copy.raw_id for copy in copies] == [message.raw_id for message in messages]
+
+    def test_delete_with_raw(self):
+        other_folder = MailboxFolderFactory.create()
+        messages = [
+            MessageFactory.build(
+                folder=folder, uid=uid, message_id='<1@mailme.test>',
+                original='Subject: test\r\n\r\nBody')
+            for folder, uid in ((self.folder, 1), (other_folder, 1), (self.folder, 2))]
+
+        RawMessage.objects.deduplicate(messages)
+        Message.objects.upsert(messages)
+
+        assert RawMessage.objects.count() == 1
+
+        # Still linked to the copy in the other folder
+        self.folder.messages.delete_with_raw()
+        assert RawMessage.objects.count() == 1
+
+        other_folder.messages.delete_with_raw()
+        assert not RawMessage.objects.exists()
@@ -11,3 +11,15 @@ class TestCeleryConfig:
         dummy_task.delay()
 
         assert True
+
+    def test_routes(self):
+        def get_queue(task):
+            return celery.amqp.router.route({}, task)['queue'].name
+
+        assert get_queue('mailme.tasks.sync.listen_mailbox') == 'idle'
+        assert get_queue('mailme.tasks.sync.backfill_mailbox') == 'backfill'
+        assert get_queue('mailme.tasks.sync.sync_mailbox') == 'sync'
+
+    def test_beat_schedule(self):
+        tasks = [entry['task'] for entry in celery.conf.beat_schedule.values()]
+        assert tasks == ['mailme.tasks.sync.schedule_syncs']
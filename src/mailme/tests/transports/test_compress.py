@@ -0,0 +1,62 @@
+import imaplib
+import io
+import zlib
+
+import mock
+import pytest
+
+from mailme.transports.compress import DeflateStream, enable_compression
+
+
+def deflate(data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def inflate(data):
+    return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data)
+
+
+class TestDeflateStream:
+
+    def get_imap(self, received):
+        imap = mock.Mock(abort=imaplib.IMAP4.abort)
+        imap.file = io.BufferedReader(io.BytesIO(deflate(received)))
+        return imap
+
+    def test_read(self):
+        body = b'Hello world ' * 1000
+        imap = self.get_imap(
+            b'* 1 FETCH (BODY[] {%d}\r\n' % len(body) + body + b')\r\n')
+        stream = DeflateStream(imap)
+
+        assert imap.readline() == b'* 1 FETCH (BODY[] {12000}\r\n'
+        assert imap.read(len(body)) == body
+        assert imap.readline() == b')\r\n'
+
+        received, received_compressed = stream.stats()
+        assert received == len(body) + 30
+        assert received_compressed < received / 10
+
+        with pytest.raises(imaplib.IMAP4.abort):
+            imap.readline()
+
+    def test_send(self):
+        imap = self.get_imap(b'')
+        send = imap.send
+        DeflateStream(imap)
+
+        imap.send(b'A001 NOOP\r\n')
+        assert inflate(send.call_args[0][0]) == b'A001 NOOP\r\n'
+
+    def test_enable_compression(self):
+        client = mock.Mock()
+        client._imap = self.get_imap(b'')
+        client._imap._simple_command.return_value = ('OK', [b'DEFLATE active'])
+
+        assert isinstance(enable_compression(client), DeflateStream)
+        client._imap._simple_command.assert_called_once_with('COMPRESS', 'DEFLATE')
+
+        client._imap = self.get_imap(b'')
+        client._imap._simple_command.return_value = ('NO', [b'Compression active'])
+        assert enable_compression(client) is None
@@ -0,0 +1,81 @@
+import mock
+
+from mailme.transports.idle import ImapIdleListener
+from mailme.transports.imap import ImapFolder
+
+
+class TestImapIdleListener:
+
+    def get_listener(self, responses, **kwargs):
+        transport = mock.Mock()
+        transport.get_folders_to_sync.return_value = [
+            ImapFolder(name='INBOX', role='inbox'),
+            ImapFolder(name='Sent', role='sent'),
+        ]
+
+        listener = ImapIdleListener(transport, **kwargs)
+        responses = iter(responses)
+
+        def idle_check(timeout=None):
+            try:
+                return next(responses)
+            except StopIteration:
+                listener.stop()
+                return []
+
+        transport.client.idle_check.side_effect = idle_check
+        return listener
+
+    def test_sync_on_change(self):
+        listener = self.get_listener([
+            [(b'OK', b'Still here')],
+            [(3, b'EXISTS')],
+            [],
+            [(2, b'FETCH', (b'FLAGS', (b'\\Seen',)))],
+        ])
+
+        listener.listen()
+
+        inbox = ImapFolder(name='INBOX', role='inbox')
+        # Initial catch up and two changes
+        assert listener.transport.sync_folder.call_args_list == [
+            mock.call(inbox)] * 3
+        assert listener.transport.client.idle.call_count == 3
+        assert listener.transport.client.idle_done.call_count == 3
+
+    def test_reissue_idle_after_timeout(self):
+        listener = self.get_listener([[], [], []], idle_timeout=0)
+
+        assert listener.wait_for_changes() is False
+        assert listener.transport.client.idle.call_count == 1
+        assert listener.transport.client.idle_done.call_count == 1
+        assert not listener.transport.client.idle_check.called
+
+    def test_sync_holds_lock(self):
+        lock = mock.Mock()
+        lock.acquire.side_effect = [False, True, True]
+        heartbeat = mock.Mock()
+
+        listener = self.get_listener([[(3, b'EXISTS')]], lock=lock, heartbeat=heartbeat)
+
+        def sync_folder(imap_folder):
+            assert lock.release.call_count == lock.acquire.call_count - 2
+            listener.transport.heartbeat()
+
+        listener.transport.sync_folder.side_effect = sync_folder
+
+        with mock.patch('mailme.transports.idle.LOCK_WAIT_INTERVAL', 0):
+            assert listener.listen()
+
+        # Waited for the lock once, then synced twice
+        assert lock.acquire.call_count == 3
+        assert lock.release.call_count == 2
+        assert lock.refresh.call_count == 2
+        assert heartbeat.called
+
+    def test_idle_not_supported(self):
+        listener = self.get_listener([])
+        listener.transport.client.has_capability.return_value = False
+
+        assert listener.listen() is False
+        assert not listener.transport.sync_folder.called
@@ -0,0 +1,95 @@
+import mock
+import pytest
+
+from mailme.transports.pool import ConnectionLimitError, ConnectionPool
+
+
+class TestConnectionPool:
+
+    def test_reuse_session(self):
+        pool = ConnectionPool()
+        connect = mock.Mock(side_effect=lambda: mock.Mock())
+
+        client = pool.acquire('key', connect)
+        pool.release('key', client)
+
+        assert pool.acquire('key', connect) is client
+        assert connect.call_count == 1
+        client.noop.assert_called_once_with()
+
+        # Sessions aren't shared between credentials
+        assert pool.acquire('other', connect) is not client
+        assert connect.call_count == 2
+
+    def test_replace_dead_session(self):
+        pool = ConnectionPool()
+        connect = mock.Mock(side_effect=lambda: mock.Mock())
+
+        client = pool.acquire('key', connect)
+        pool.release('key', client)
+        client.noop.side_effect = OSError('Connection reset')
+
+        assert pool.acquire('key', connect) is not client
+        assert connect.call_count == 2
+
+    def test_evict_sessions(self):
+        pool = ConnectionPool(max_idle=1, max_idle_time=60)
+        connect = mock.Mock(side_effect=lambda: mock.Mock())
+
+        first = pool.acquire('first', connect)
+        second = pool.acquire('second', connect)
+        pool.release('first', first)
+        pool.release('second', second)
+
+        # Least recently used session is logged out
+        first.logout.assert_called_once_with()
+        assert not second.logout.called
+
+        with mock.patch('mailme.transports.pool.time.monotonic',
+                        return_value=pool._idle[('second', id(second))][1] + 61):
+            assert pool.acquire('second', connect) is not second
+
+        second.logout.assert_called_once_with()
+
+    def test_discard_session(self):
+        pool = ConnectionPool()
+        connect = mock.Mock(side_effect=lambda: mock.Mock())
+
+        client = pool.acquire('key', connect)
+        pool.release('key', client, discard=True)
+
+        client.logout.assert_called_once_with()
+        assert pool.acquire('key', connect) is not client
+
+    def test_max_connections(self):
+        pool = ConnectionPool(timeout=0)
+        connect = mock.Mock(side_effect=lambda: mock.Mock())
+
+        client = pool.acquire('key', connect, max_connections=1)
+
+        with pytest.raises(ConnectionLimitError):
+            pool.acquire('key', connect, max_connections=1)
+
+        pool.release('key', client)
+        assert pool.acquire('key', connect, max_connections=1) is client
+
+    def test_logout_outside_of_lock(self):
+        pool = ConnectionPool(max_idle=1, max_idle_time=60)
+        locked = []
+
+        def connect():
+            client = mock.Mock()
+            client.logout.side_effect = lambda: locked.append(pool._condition._is_owned())
+            return client
+
+        first = pool.acquire('first', connect)
+        second = pool.acquire('second', connect)
+        pool.release('first', first)
+        pool.release('second', second)
+
+        with mock.patch('mailme.transports.pool.time.monotonic',
+                        return_value=pool._idle[('second', id(second))][1] + 61):
+            pool.acquire('second', connect)
+
+        # Evicted and expired sessions
+        assert locked == [False, False]
@@ -0,0 +1,26 @@
+from mailme.utils.bloom import BloomFilter
+
+
+class TestBloomFilter:
+
+    def test_contains_added_keys(self):
+        seen = BloomFilter(capacity=1000)
+        keys = [f'{index}@mailme.test' for index in range(1000)]
+
+        for key in keys:
+            seen.add(key)
+
+        assert all(key in seen for key in keys)
+        assert len(seen) == 1000
+        assert not seen.is_full
+
+    def test_false_positive_rate(self):
+        seen = BloomFilter(capacity=1000, error_rate=0.01)
+
+        for index in range(1000):
+            seen.add(f'{index}@mailme.test')
+
+        false_positives = sum(
+            f'{index}@other.test' in seen for index in range(10000))
+
+        assert false_positives < 300
@@ -0,0 +1,51 @@
+from mailme.utils.bodystructure import get_attachments, get_text_sections, walk
+from mailme.utils.test import parse_bodystructure
+
+
+MIXED = parse_bodystructure(
+    b'((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "QUOTED-PRINTABLE" 20 2 NIL NIL NIL)'
+    b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "BASE64" 40 1 NIL NIL NIL)'
+    b' "ALTERNATIVE" ("BOUNDARY" "b1") NIL NIL)'
+    b'("APPLICATION" "PDF" ("NAME" "a.pdf") NIL NIL "BASE64" 5000 NIL'
+    b' ("ATTACHMENT" ("FILENAME" "report.pdf")) NIL)'
+    b'("TEXT" "PLAIN" ("CHARSET" "us-ascii") NIL NIL "7BIT" 30 3 NIL'
+    b' ("ATTACHMENT" ("FILENAME" "notes.txt")) NIL)'
+    b' "MIXED" ("BOUNDARY" "b0") NIL NIL)')
+
+SINGLE = parse_bodystructure(
+    b'("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 20 2 NIL NIL NIL)')
+
+
+class TestBodyStructure:
+
+    def test_walk(self):
+        assert [section for section, _ in walk(MIXED)] == ['1.1', '1.2', '2', '3']
+        assert [section for section, _ in walk(SINGLE)] == ['1']
+
+    def test_get_text_sections(self):
+        assert get_text_sections(MIXED) == ('1.1', '1.2')
+
+        # Fetched as a whole
+        assert get_text_sections(SINGLE) is None
+        assert get_text_sections(None) is None
+
+    def test_get_attachments(self):
+        assert get_attachments(MIXED) == [{
+            'section': '2',
+            'content_type': 'application/pdf',
+            'charset': None,
+            'encoding': 'base64',
+            'size': 5000,
+            'disposition': 'attachment',
+            'filename': 'report.pdf',
+        }, {
+            'section': '3',
+            'content_type': 'text/plain',
+            'charset': 'us-ascii',
+            'encoding': '7bit',
+            'size': 30,
+            'disposition': 'attachment',
+            'filename': 'notes.txt',
+        }]
+
+        assert get_attachments(SINGLE) == []
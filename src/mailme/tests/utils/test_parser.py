@@ -1,9 +1,13 @@
 import os
 import email
+import base64
 
+import mock
 from django.conf import settings
 
-from mailme.utils.parser import parse_email, get_mail_addresses
+from mailme.utils.parser import (
+    ATTACHMENT_SPOOL_SIZE, CHARDET_SAMPLE_SIZE, parse_email, parse_email_stream,
+    parse_headers, get_mail_addresses)
 from mailme.tests.utils.samples import generate_parameters, SAMPLE_MAILS
 
 
@@ -30,12 +34,111 @@ class TestParser:
         assert parsed == expected
         assert isinstance(parsed['original'], str)
 
+    @generate_parameters(SAMPLE_MAILS)
+    def test_simple_bytes(self, file, expected):
+        raw = self.open_mail(file).encode('utf-8')
+        assert parse_email(raw) == expected
+
+    def test_parse_bytes_charsets(self):
+        raw = (
+            'Subject: Grüße\r\nFrom: Jörg <joerg@mailme.test>\r\n'
+            'Content-Type: multipart/alternative; boundary="b"\r\n\r\n'
+            '--b\r\nContent-Type: text/plain; charset="iso-8859-1"\r\n'
+            'Content-Transfer-Encoding: 8bit\r\n\r\nHällo\r\n'
+            '--b\r\nContent-Type: text/html; charset="utf-8"\r\n'
+            'Content-Transfer-Encoding: 8bit\r\n\r\n'
+        ).encode('latin-1') + '<p>Hällo</p>\r\n--b--\r\n'.encode('utf-8')
+
+        parsed = parse_email(raw)
+
+        assert parsed['body']['plain'] == ['Hällo']
+        assert parsed['body']['html'] == ['<p>Hällo</p>']
+        assert parsed['from'] == [{'name': 'Jörg', 'email': 'joerg@mailme.test'}]
+        assert parsed['subject'] == 'Grüße'
+        assert isinstance(parsed['original'], str)
+
+    def test_chardet_sample_is_bounded(self):
+        body = ('a' * CHARDET_SAMPLE_SIZE * 4 + 'Grüße').encode('latin-1')
+        raw = b'Content-Type: text/plain; charset="utf-8"\r\n\r\n' + body
+
+        with mock.patch('mailme.utils.parser.chardet.detect',
+                        return_value={'encoding': 'iso-8859-1'}) as detect:
+            parsed = parse_email(raw)
+
+        assert parsed['body']['plain'] == [body.decode('latin-1')]
+        assert all(
+            len(sample) <= CHARDET_SAMPLE_SIZE for (sample,), _ in detect.call_args_list)
+
+    def test_parse_email_stream(self):
+        raw = self.open_mail('generic.txt').encode('utf-8')
+        chunks = [raw[offset:offset + 10] for offset in range(0, len(raw), 10)]
+
+        assert parse_email_stream(chunks) == parse_email(raw)
+        assert parse_email_stream(iter(chunks))['original'] == raw.decode('utf-8')
+        assert parse_email_stream(chunks, keep_original=False)['original'] == ''
+
+    def test_spooled_attachment(self):
+        data = bytes(range(256)) * (ATTACHMENT_SPOOL_SIZE // 128)
+        raw = (
+            b'Content-Type: multipart/mixed; boundary="b"\r\n\r\n'
+            b'--b\r\nContent-Type: text/plain\r\n\r\nBody\r\n'
+            b'--b\r\nContent-Type: application/octet-stream\r\n'
+            b'Content-Disposition: attachment; filename=data.bin\r\n'
+            b'Content-Transfer-Encoding: base64\r\n\r\n' +
+            base64.encodebytes(data) + b'--b--\r\n')
+
+        attachment, = parse_email(raw)['attachments']
+
+        assert attachment['size'] == len(data)
+        assert attachment['filename'] == 'data.bin'
+        # Rolled over to disk
+        assert attachment['content']._rolled
+        assert attachment['content'].read() == data
+
+    @generate_parameters(SAMPLE_MAILS)
+    def test_parse_headers(self, file, expected):
+        raw = self.open_mail(file)
+        expected = {
+            key: value for key, value in expected.items()
+            if key not in ('original', 'body', 'attachments')}
+
+        assert parse_headers(raw) == expected
+        assert parse_headers(raw.encode('utf-8')) == expected
+
+    def test_body_is_decoded_lazily(self):
+        raw = self.open_mail('generic.txt')
+
+        with mock.patch('mailme.utils.parser.decode_content',
+                        return_value='Hello') as decode_content:
+            parsed = parse_email(raw)
+
+            assert parsed['subject'] == 'Message Without Attachment'
+            assert 'body' in parsed
+            assert not decode_content.called
+
+            assert parsed['body'] == {'plain': ['Hello'], 'html': []}
+            assert parsed['body'] == {'plain': ['Hello'], 'html': []}
+            assert decode_content.call_count == 1
+
+        parsed['parsed_date'] = None
+        assert dict(parsed)['parsed_date'] is None
+
     def test_parse_email_case_insensitive_header(self):
         assert parse_email('Message-ID: one')['message_id'] == 'one'
         assert parse_email('Message-Id: one')['message_id'] == 'one'
         assert parse_email('Message-id: one')['message_id'] == 'one'
         assert parse_email('message-id: one')['message_id'] == 'one'
 
+    def test_parse_email_malformed_date(self):
+        parsed = parse_email('Date: not a date\r\nSubject: spam\r\n\r\nBody')
+
+        assert parsed['date'] == 'not a date'
+        assert 'parsed_date' not in parsed
+        assert parsed['subject'] == 'spam'
+
+        parsed = parse_email('Date: Mon, 32 Feb 2018 25:61:00 +0000\r\n\r\nBody')
+        assert 'parsed_date' not in parsed
+
     def test_get_mail_addresses(self):
         to_address = email.message_from_string('To: John Doe <johndoe@gmail.com>')
         from_address = email.message_from_string('From: John Smith <johnsmith@gmail.com>')
@@ -0,0 +1,56 @@
+from mailme.utils.uidset import UidSet
+
+
+class TestUidSet:
+
+    def test_collapse(self):
+        uids = UidSet([13, 1, 2, 3, 4, 5, 10, 12, 3])
+        assert uids.ranges() == [(1, 5), (10, 10), (12, 13)]
+        assert str(uids) == '1:5,10,12:13'
+        assert len(uids) == 8
+        assert list(uids) == [1, 2, 3, 4, 5, 10, 12, 13]
+
+    def test_empty(self):
+        uids = UidSet()
+        assert not uids
+        assert len(uids) == 0
+        assert str(uids) == ''
+
+    def test_contains(self):
+        uids = UidSet([1, 2, 3, 10, 12, 13])
+        assert 2 in uids
+        assert 12 in uids
+        assert 4 not in uids
+        assert 14 not in uids
+        assert 0 not in uids
+
+    def test_difference(self):
+        uids = UidSet(range(1, 21))
+        other = UidSet([0, 1, 5, 6, 7, 15, 20, 25])
+        assert list(uids - other) == [
+            uid for uid in range(1, 21) if uid not in set(other)]
+        assert uids - UidSet() == uids
+        assert not UidSet() - uids
+
+    def test_intersection(self):
+        uids = UidSet([1, 2, 3, 7, 8, 9, 20])
+        other = UidSet([2, 3, 4, 8, 20, 21])
+        assert list(uids & other) == [2, 3, 8, 20]
+        assert not uids & UidSet()
+
+    def test_union(self):
+        uids = UidSet([1, 2, 3, 10, 20])
+        other = UidSet([4, 5, 9, 15, 21, 30])
+        assert str(uids | other) == '1:5,9:10,15,20:21,30'
+        assert uids | UidSet() == uids
+
+    def test_from_sequence(self):
+        assert list(UidSet.from_sequence(b'1:3,7,10:9')) == [1, 2, 3, 7, 9, 10]
+        assert str(UidSet.from_sequence('5,1:3,2:4')) == '1:5'
+        assert not UidSet.from_sequence('')
+
+    def test_min_max_reversed(self):
+        uids = UidSet.from_sequence('3:5,10')
+        assert uids.min == 3
+        assert uids.max == 10
+        assert list(reversed(uids)) == [10, 5, 4, 3]
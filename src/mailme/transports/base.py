@@ -1,6 +1,71 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from mailme.utils.logging import logged
 from mailme.utils.parser import parse_email
 
 
+_parse_executors = {}
+
+
+@logged
+def get_parse_executor(kind='thread', max_workers=None):
+    """Return the executor of `kind` for `EmailTransport.parse_executor`.
+
+    `kind` is ``'thread'`` or ``'process'``, an executor is created once
+    and shared by all transports of the process. Threads overlap parsing
+    with network I/O in any worker pool. Processes parse in parallel too,
+    but can't be started from daemonic processes like the ones of the
+    celery prefork pool, threads are used there instead.
+    """
+    if kind == 'process' and multiprocessing.current_process().daemon:
+        get_parse_executor.logger.warning(
+            'Can\'t start parse processes from a daemonic process, using threads.')
+        kind = 'thread'
+
+    if kind not in _parse_executors:
+        executor_class = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+        _parse_executors[kind] = executor_class(max_workers=max_workers)
+
+    return _parse_executors[kind]
+
+
+def parse_email_decoded(content):
+    """`parse_email` for a `parse_executor`.
+
+    The result is fully decoded, that's the work the executor is for, so
+    nothing is left to decode lazily by the thread that stores it. The
+    exception are attachments. They aren't stored, the sync records them
+    from BODYSTRUCTURE, so they are neither decoded nor returned.
+    """
+    parsed = parse_email(content)
+    del parsed['attachments']
+    return dict(parsed)
+
+
 class EmailTransport(object):
+    # Optional `concurrent.futures.Executor` used to parse messages,
+    # parsing is CPU bound and doesn't need to block the transport.
+    parse_executor = None
+
+    # Number of messages sent to a `ProcessPoolExecutor` at once
+    parse_batch_size = 50
+
     def get_email_from_bytes(self, contents):
         return parse_email(contents)
+
+    def parse_emails(self, contents):
+        """Start parsing raw messages, returns an iterator of the results.
+
+        With a `parse_executor` all messages are submitted right away and
+        parsed while the caller goes on, e.g fetching the next messages.
+        Iterating waits for the results, in order.
+        """
+        if self.parse_executor is None:
+            return (self.get_email_from_bytes(content) for content in contents)
+
+        if isinstance(self.parse_executor, ProcessPoolExecutor):
+            return self.parse_executor.map(
+                parse_email_decoded, contents, chunksize=self.parse_batch_size)
+
+        return self.parse_executor.map(parse_email_decoded, contents)
@@ -0,0 +1,87 @@
+import imaplib
+import zlib
+
+
+# Like `IMAPClient` does for the commands it supports
+if 'COMPRESS' not in imaplib.Commands:
+    imaplib.Commands['COMPRESS'] = ('AUTH', 'SELECTED')
+
+READ_SIZE = 64 * 1024
+
+
+class DeflateStream(object):
+    """Compress the connection of an `imaplib.IMAP4` instance (RFC 4978).
+
+    Replaces the `send`, `read` and `readline` methods of the connection,
+    everything on top of them (imaplib, IMAPClient) keeps working with
+    uncompressed data. Counts the bytes on both sides of the compression.
+    """
+
+    def __init__(self, imap):
+        self.imap = imap
+        self._send = imap.send
+
+        # Raw DEFLATE without zlib header and checksum
+        self.compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.buffer = bytearray()
+
+        self.received = self.received_compressed = 0
+        self.sent = self.sent_compressed = 0
+
+        imap.send = self.send
+        imap.read = self.read
+        imap.readline = self.readline
+
+    def send(self, data):
+        compressed = (
+            self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+        self.sent += len(data)
+        self.sent_compressed += len(compressed)
+        self._send(compressed)
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            self._fill()
+
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def readline(self):
+        while b'\n' not in self.buffer:
+            self._fill()
+
+        return self.read(self.buffer.index(b'\n') + 1)
+
+    def _fill(self):
+        data = self.imap.file.read1(READ_SIZE)
+
+        if not data:
+            raise self.imap.abort('socket error: EOF')
+
+        decompressed = self.decompressor.decompress(data)
+
+        self.received += len(decompressed)
+        self.received_compressed += len(data)
+        self.buffer.extend(decompressed)
+
+    def stats(self):
+        """Return ``(received, received_compressed)`` byte counts."""
+        return self.received, self.received_compressed
+
+
+def enable_compression(client):
+    """Issue COMPRESS DEFLATE on an `IMAPClient` connection.
+
+    Returns the `DeflateStream` or `None` if the server refused, e.g
+    because the TLS layer already compresses.
+    """
+    typ, _ = client._imap._simple_command('COMPRESS', 'DEFLATE')
+
+    if typ != 'OK':
+        return None
+
+    return DeflateStream(client._imap)
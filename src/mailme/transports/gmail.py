@@ -0,0 +1,103 @@
+from django.db.models import Case, Value, When
+from django.db.models.functions import Cast
+from imapclient import imap_utf7
+
+from .imap import METADATA_FETCH_ITEMS, ImapTransport
+from mailme.constants import ALL, JUNK, TRASH
+from mailme.models import Message
+
+
+GMAIL_HOSTS = ('imap.gmail.com', 'imap.googlemail.com')
+
+# Every message is in exactly one of these folders, labels (including
+# the inbox) are just views on `[Gmail]/All Mail`.
+GMAIL_SYNC_ROLES = (ALL, JUNK, TRASH)
+
+GMAIL_METADATA_FETCH_ITEMS = METADATA_FETCH_ITEMS + (
+    'X-GM-MSGID', 'X-GM-THRID', 'X-GM-LABELS'
+)
+
+
+def is_gmail(mailbox):
+    return mailbox.provider == 'gmail' or mailbox.parsed_uri.location in GMAIL_HOSTS
+
+
+def get_labels(data):
+    # Numeric labels are parsed as integers
+    return [str(imap_utf7.decode(label)) for label in data.get(b'X-GM-LABELS', ())]
+
+
+class GmailTransport(ImapTransport):
+    """Sync a Gmail account without downloading a message once per label.
+
+    Only `[Gmail]/All Mail`, spam and trash are synced, the labels of a
+    message are stored from X-GM-LABELS instead. Messages moving between
+    these folders are recognized by their X-GM-MSGID and re-assigned
+    instead of being downloaded again.
+    """
+    metadata_fetch_items = GMAIL_METADATA_FETCH_ITEMS
+
+    def get_folders_to_sync(self):
+        folders = self.folders()
+        return [
+            folder
+            for role in GMAIL_SYNC_ROLES
+            for folder in folders if folder.role == role]
+
+    def move_known_messages(self, folder, messages):
+        """Re-assign messages stored in another folder to `folder`."""
+        uids_by_msgid = {
+            data[b'X-GM-MSGID']: uid for uid, data in messages.items()
+            if b'X-GM-MSGID' in data}
+
+        if not uids_by_msgid:
+            return messages
+
+        known = Message.objects.filter(
+            folder__mailbox=self.mailbox, gm_msgid__in=list(uids_by_msgid)
+        ).values_list('pk', 'gm_msgid')
+
+        moved = {
+            pk: dict(uid=uids_by_msgid[gm_msgid], **self.get_metadata_fields(
+                messages[uids_by_msgid[gm_msgid]]))
+            for pk, gm_msgid in known}
+
+        if not moved:
+            return messages
+
+        updates = {}
+
+        for field in next(iter(moved.values())):
+            output_field = Message._meta.get_field(field)
+
+            # Typed explicitly, e.g JSON parameters are sent as text
+            updates[field] = Case(
+                *[When(pk=pk, then=Cast(
+                    Value(values[field], output_field=output_field), output_field))
+                  for pk, values in moved.items()],
+                output_field=output_field)
+
+        Message.objects.filter(pk__in=list(moved)).update(folder=folder, **updates)
+
+        moved_uids = {values['uid'] for values in moved.values()}
+        return {uid: data for uid, data in messages.items() if uid not in moved_uids}
+
+    def get_metadata_fields(self, metadata):
+        fields = super().get_metadata_fields(metadata)
+        fields.update({
+            'gm_msgid': metadata.get(b'X-GM-MSGID'),
+            'gm_thrid': metadata.get(b'X-GM-THRID'),
+            'labels': get_labels(metadata),
+        })
+        return fields
+
+    def update_metadata(self, folder, changed):
+        super().update_metadata(folder, changed)
+
+        changed_labels = {}
+
+        for uid, data in changed.items():
+            changed_labels.setdefault(tuple(get_labels(data)), []).append(uid)
+
+        for labels, uids in changed_labels.items():
+            folder.messages.filter(uid__in=uids).update(labels=list(labels))
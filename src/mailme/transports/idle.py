@@ -0,0 +1,151 @@
+import threading
+import time
+
+from mailme.constants import ALL, INBOX
+from mailme.utils.logging import logged
+
+
+# Servers are allowed to drop IDLE connections after 30 minutes of
+# inactivity (RFC 2177), so we re-issue the command a bit earlier.
+IDLE_TIMEOUT = 29 * 60
+
+# Untagged responses that tell us that the selected folder changed.
+IDLE_TRIGGERS = {b'EXISTS', b'EXPUNGE', b'FETCH', b'VANISHED'}
+
+# Seconds between two attempts to take the lock of a mailbox that is
+# synced by someone else.
+LOCK_WAIT_INTERVAL = 5
+
+
+@logged
+class ImapIdleListener(object):
+    """Push based sync of the inbox folder of an `ImapTransport`.
+
+    Instead of polling every `DEFAULT_POLL_FREQUENCY` seconds the folder
+    is kept in IMAP IDLE mode and an incremental sync is only triggered
+    once the server reports a change.
+
+    Every sync of the folder holds `lock`, e.g a `SyncLock`, so that it
+    doesn't run at the same time as other syncs of the mailbox.
+    `heartbeat` is called at least every `check_interval` seconds while
+    idling and after every stored chunk while syncing.
+    """
+
+    def __init__(self, transport, idle_timeout=IDLE_TIMEOUT, check_interval=60,
+                 lock=None, heartbeat=None):
+        # `idle_check` waits on the socket, data already decompressed and
+        # buffered by COMPRESS=DEFLATE would go unnoticed.
+        transport.compress = False
+
+        self.transport = transport
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.lock = lock
+        self.heartbeat = heartbeat
+        self.stopped = threading.Event()
+
+        # The folder we listen on, set by `listen`
+        self.folder = None
+
+    def get_folder(self):
+        imap_folders = self.transport.get_folders_to_sync()
+
+        # Gmail only syncs `All Mail`, new messages show up there too
+        for role in (INBOX, ALL):
+            for imap_folder in imap_folders:
+                if imap_folder.role == role:
+                    return imap_folder
+        return None
+
+    def listen(self):
+        """Block and sync the inbox whenever it changes until `stop` is called.
+
+        Returns `False` right away if the mailbox can't be listened to.
+        """
+        if not self.transport.client.has_capability('IDLE'):
+            self.logger.info(
+                'Server of mailbox %r doesn\'t support IDLE, not listening.',
+                self.transport.mailbox.pk)
+            return False
+
+        self.folder = self.get_folder()
+
+        if self.folder is None:
+            self.logger.warning(
+                'No inbox found for mailbox %r, not listening.',
+                self.transport.mailbox.pk)
+            return False
+
+        # Catch up with everything that happened while we weren't
+        # listening, this also leaves the folder selected for IDLE.
+        self.sync_folder()
+
+        while not self.stopped.is_set():
+            if self.wait_for_changes():
+                self.sync_folder()
+
+        return True
+
+    def stop(self):
+        self.stopped.set()
+
+    def sync_folder(self):
+        if self.lock is None:
+            self.transport.heartbeat = self.heartbeat
+            self.transport.sync_folder(self.folder)
+            return
+
+        while not self.lock.acquire():
+            # Wait for the poll or backfill of the mailbox to finish
+            if self.stopped.wait(LOCK_WAIT_INTERVAL):
+                return
+
+            if self.heartbeat is not None:
+                self.heartbeat()
+
+        self.transport.heartbeat = self.sync_heartbeat
+
+        try:
+            self.transport.sync_folder(self.folder)
+        finally:
+            self.lock.release()
+
+    def sync_heartbeat(self):
+        self.lock.refresh()
+
+        if self.heartbeat is not None:
+            self.heartbeat()
+
+    def wait_for_changes(self):
+        """Idle until the server reports a change or `idle_timeout` passed.
+
+        Returns `True` if the selected folder changed.
+        """
+        client = self.transport.client
+        deadline = time.monotonic() + self.idle_timeout
+
+        client.idle()
+
+        try:
+            while not self.stopped.is_set():
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    return False
+
+                responses = client.idle_check(
+                    timeout=min(remaining, self.check_interval))
+
+                if self.heartbeat is not None:
+                    self.heartbeat()
+
+                if any(self.is_change(response) for response in responses):
+                    return True
+        finally:
+            client.idle_done()
+
+        return False
+
+    def is_change(self, response):
+        # Responses look like `(3, b'EXISTS')` or `(b'VANISHED', ...)`
+        return any(item in IDLE_TRIGGERS for item in response[:2])
@@ -1,33 +1,270 @@
+import email
+import hashlib
 import imaplib
+import re
 import ssl
+import threading
 from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from email.parser import BytesHeaderParser
+from itertools import islice
+from queue import Empty, Queue
 
-from django.db.models import Max
-from imapclient import IMAPClient
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Case, F, Q, Value, When
+from django.utils import timezone
+from django.utils.encoding import force_text
+from imapclient import IMAPClient, imap_utf7
+from imapclient.exceptions import IMAPClientError
+from imapclient.response_parser import parse_response
 
 from .base import EmailTransport
+from .compress import DeflateStream, enable_compression
+from .pool import DEFAULT_MAX_CONNECTIONS, connection_pool
 from mailme.constants import (
     DEFAULT_FOLDER_FLAGS, DEFAULT_FOLDER_MAPPING, IGNORE_FOLDER_NAMES,
     REVERSE_POPULAR_SPECIAL_FOLDERS
 )
+from mailme.models import (
+    MESSAGE_BODY_FIELDS, MailboxFolder, Message, RawMessage, get_raw_message_key
+)
+from mailme.providers import PROVIDERS
+from mailme.utils.bloom import BloomFilter
+from mailme.utils.bodystructure import get_attachments, get_text_sections
+from mailme.utils.logging import logged
+from mailme.utils.parser import decode_bytes, decode_mail_header, parse_headers
+from mailme.utils.uidset import UidSet
 from mailme.utils.uri import parse_uri
 
 
 DEFAULT_POLL_FREQUENCY = 30
 imaplib.Debug = 4
 
+HEADER_PARSER = BytesHeaderParser()
+
 ImapFolder = namedtuple('ImapFolder', ('name', 'role'))
 
+ACCOUNT_CACHE_KEY = 'mailme:imap:account:{}'
+
+# `BloomFilter` of the stored raw messages per mailbox, see
+# `ImapTransport.get_raw_message_filter`. The most recently used ones are
+# kept in memory, all of them in the shared cache.
+RAW_MESSAGE_FILTERS = OrderedDict()
+RAW_MESSAGE_FILTERS_LOCK = threading.Lock()
+MAX_RAW_MESSAGE_FILTERS = 100
+RAW_MESSAGE_FILTER_CACHE_KEY = 'mailme:imap:raw-filter:{}'
+RAW_MESSAGE_FILTER_CACHE_TTL = 24 * 60 * 60
+
+METADATA_FETCH_ITEMS = (
+    'FLAGS', 'UID', 'BODYSTRUCTURE', 'INTERNALDATE', 'RFC822.SIZE'
+)
+
+# Enough to recognize already stored messages after UIDVALIDITY changed
+RESYNC_FETCH_ITEMS = (
+    'FLAGS', 'INTERNALDATE', 'RFC822.SIZE',
+    'BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)]'
+)
+
+
+# Headers `parse_email` looks at, fetched instead of the full message in
+# headers-first mode.
+HEADER_FETCH_ITEMS = (
+    'BODY.PEEK[HEADER.FIELDS (FROM TO CC BCC REPLY-TO IN-REPLY-TO SUBJECT DATE '
+    'MESSAGE-ID CONTENT-TYPE MIME-VERSION RECEIVED-SPF X-SPAM-STATUS X-SPAM-SCORE)]',
+)
+
+BODY_FETCH_ITEMS = ('BODY.PEEK[]',)
+
+RE_SECTION_KEY = re.compile(br'^BODY\[([0-9.]+)\]$')
+
+
+def get_partial_fetch_items(sections):
+    """Fetch items for the header and the given text sections only."""
+    items = ['BODY.PEEK[HEADER]']
+
+    for section in sections:
+        items.extend((f'BODY.PEEK[{section}.MIME]', f'BODY.PEEK[{section}]'))
+
+    return items
+
+
+def build_partial_message(data):
+    """Join the parts of a partial fetch into a ``multipart/mixed`` message.
+
+    The result only contains the fetched text parts but can be parsed just
+    like the full message. It's parser input only, its header isn't the
+    one of the message, see `get_partial_header`.
+    """
+    sections = sorted(
+        (match.group(1) for match in map(RE_SECTION_KEY.match, data) if match),
+        key=lambda section: [int(number) for number in section.split(b'.')])
+
+    # Derived from the content, it must not occur in the parts
+    digest = hashlib.sha1(data[b'BODY[HEADER]'])
+    for section in sections:
+        digest.update(data[b'BODY[' + section + b']'] or b'')
+
+    boundary = f'=_mailme_{digest.hexdigest()}'
+    header = HEADER_PARSER.parsebytes(data[b'BODY[HEADER]'])
+    del header['Content-Type']
+    header['Content-Type'] = f'multipart/mixed; boundary="{boundary}"'
+
+    delimiter = f'--{boundary}\r\n'.encode()
+    content = [header.as_bytes()]
 
+    for section in sections:
+        content.extend((
+            delimiter,
+            data.get(b'BODY[' + section + b'.MIME]') or b'\r\n',
+            data[b'BODY[' + section + b']'] or b'',
+            b'\r\n'))
+
+    content.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(content)
+
+
+def get_fetched_content(data):
+    """Return the raw message of a fetch response and whether it's complete."""
+    if b'BODY[]' in data:
+        return data[b'BODY[]'], True
+
+    if b'BODY[HEADER]' in data and any(map(RE_SECTION_KEY.match, data)):
+        return build_partial_message(data), True
+
+    for key, value in data.items():
+        if key.upper().startswith(b'BODY[HEADER'):
+            return value or b'', False
+
+    return b'', False
+
+
+def get_partial_header(data):
+    """Return the real header of a partial fetch, `None` for other fetches."""
+    if b'BODY[]' in data or b'BODY[HEADER]' not in data:
+        return None
+
+    if not any(map(RE_SECTION_KEY.match, data)):
+        return None
+
+    return data[b'BODY[HEADER]']
+
+
+def restore_partial_header(parsed, header):
+    """Replace what came from the synthetic header of a partial message.
+
+    The header fields, ``headers`` and ``original`` of `parsed` are taken
+    from the real `header`, the body and attachments of the partial
+    message are kept.
+    """
+    if header is not None:
+        parsed.update(parse_headers(header))
+        parsed['original'] = decode_bytes(header)
+
+    return parsed
+
+
+def get_header_field(data, name):
+    """Return the decoded header `name` of a ``BODY[HEADER.FIELDS ...]`` fetch."""
+    for key, value in data.items():
+        if key.upper().startswith(b'BODY[HEADER') and value:
+            return decode_mail_header(HEADER_PARSER.parsebytes(value).get(name, ''))
+    return ''
+
+
+# Settings and hooks of a transport that `ImapTransport.copy` carries over
+COPIED_ATTRIBUTES = (
+    'fetch_batch_bytes', 'persist_batch_size', 'metadata_fetch_items', 'pool',
+    'compress', 'headers_first', 'skip_attachments', 'initial_sync_days',
+    'initial_sync_messages', 'backfill_batch_size', 'resync_batch_size', 'status_precheck',
+    'account_cache_ttl', 'deduplicate', 'parse_executor', 'heartbeat')
+
+
+@logged
 class ImapTransport(EmailTransport):
+    # Upper bound of message bytes requested with a single `BODY.PEEK[]`
+    # fetch, based on the `RFC822.SIZE` of the messages.
+    fetch_batch_bytes = 20 * 1024 * 1024
+
+    # Number of messages written with a single multi-row upsert.
+    persist_batch_size = 500
+
+    # Items of the first fetch for new and changed messages.
+    metadata_fetch_items = METADATA_FETCH_ITEMS
+
+    # Logged in sessions are shared between transports of the same mailbox,
+    # `None` opens a new connection for every transport.
+    pool = connection_pool
+
+    # Use COMPRESS=DEFLATE (RFC 4978) if the server supports it
+    compress = True
+
+    # Number of connections used to sync the folders of an account in
+    # parallel, the selected folder is per connection.
+    folder_connections = 1
+
+    # Only fetch headers and metadata while syncing so that new accounts
+    # get a usable message list quickly, bodies are downloaded later on
+    # by `fetch_bodies`.
+    headers_first = False
+
+    # Only fetch the text bodies of multipart messages, attachments are
+    # recorded from BODYSTRUCTURE and can be fetched with `fetch_attachment`.
+    skip_attachments = True
+
+    # Limit the initial sync of a folder to the messages of the last
+    # `initial_sync_days` days and/or the newest `initial_sync_messages`,
+    # fetched newest first. Older messages are fetched in batches of
+    # `backfill_batch_size` by `backfill_folder` later on. `None` for both
+    # fetches everything right away.
+    initial_sync_days = None
+    initial_sync_messages = None
+    backfill_batch_size = 1000
+
+    # Number of UIDs whose identity is fetched and matched at once when
+    # resynchronizing a folder after its UIDVALIDITY changed.
+    resync_batch_size = 1000
+
+    # Ask for the status of all folders with a single LIST-STATUS command
+    # (RFC 5819) or pipelined STATUS commands before a sync and only SELECT
+    # the folders that changed.
+    status_precheck = True
+
+    # Seconds the capabilities, namespace and folder list of an account
+    # are cached, see `get_account_info`.
+    account_cache_ttl = 15 * 60
+
+    # Store the raw text of messages found in several folders or mailboxes
+    # only once, see `RawMessageQuerySet.deduplicate`.
+    deduplicate = True
+
+    # Names of folders `sync` leaves out, e.g the inbox while an IDLE
+    # listener keeps it in sync.
+    skip_folders = frozenset()
+
     def __init__(self, uri, mailbox, disable_cert_check=False):
-        if isinstance(uri, str):
-            self.uri = parse_uri(uri)
+        self.uri = parse_uri(uri) if isinstance(uri, str) else uri
 
         self.mailbox = mailbox
         self._client = None
         self._disable_cert_check = disable_cert_check
 
+        self.condstore_enabled = False
+        self.qresync_enabled = False
+
+        # Set once a sync left older messages for `backfill_folder`
+        self.backfill_pending = False
+
+        # Number of messages stored by this transport, new or updated
+        self.stored_messages = 0
+
+        # Called after every stored chunk, e.g to extend a lock
+        self.heartbeat = None
+
+        self._deferred_states = None
+        self._compression_stats = None
+
     def connect(self):
         kwargs = {}
 
@@ -49,79 +286,1021 @@ class ImapTransport(EmailTransport):
             ssl=self.uri.use_ssl,
             **kwargs)
 
+        # Return timezone aware datetimes for INTERNALDATE
+        client.normalise_times = False
+
         if self.uri.use_tls:
             client.starttls()
 
-        # TODO: Check for condstore and enable
-        # if client.has_capability('ENABLE') and client.has_capability('CONDSTORE'):
-        #       client.enable('CONDSTORE')
-        #       condstore_enabled = True
-
         client.login(self.uri.username, self.uri.password)
+
+        # CONDSTORE and QRESYNC (RFC 7162) have to be enabled after
+        # authentication, they allow us to only ask for changes since the
+        # last known `highestmodseq` of a folder.
+        enabled = []
+        if client.has_capability('ENABLE'):
+            extensions = [
+                extension for extension in ('CONDSTORE', 'QRESYNC')
+                if client.has_capability(extension)]
+
+            if extensions:
+                enabled = client.enable(*extensions)
+
+        # Stored on the session so that it survives being pooled
+        client.enabled_extensions = frozenset(enabled)
+        client.compression = None
+
+        if self.compress and client.has_capability('COMPRESS=DEFLATE'):
+            client.compression = enable_compression(client)
+
         return client
 
+    @property
+    def pool_key(self):
+        return (
+            self.uri.location, self.uri.port, self.uri.use_ssl, self.uri.use_tls,
+            self.uri.username, self.uri.password, self.compress)
+
+    def get_max_connections(self):
+        provider = PROVIDERS.get(self.mailbox.provider, {})
+        return provider.get('max_connections', DEFAULT_MAX_CONNECTIONS)
+
     @property
     def client(self):
         if self._client is None:
-            self._client = self.connect()
+            if self.pool is None:
+                self._client = self.connect()
+            else:
+                self._client = self.pool.acquire(
+                    self.pool_key, self.connect, self.get_max_connections())
+
+            enabled = self._client.enabled_extensions
+            self.qresync_enabled = b'QRESYNC' in enabled
+
+            # QRESYNC implies CONDSTORE
+            self.condstore_enabled = self.qresync_enabled or b'CONDSTORE' in enabled
+
+            self._compression_stats = self.get_compression_stats()
+
         return self._client
 
+    def get_compression_stats(self):
+        stream = getattr(self._client, 'compression', None)
+
+        if isinstance(stream, DeflateStream):
+            return stream.stats()
+        return None
+
+    def log_compression_ratio(self):
+        """Log how well the data received since `client` was acquired compressed."""
+        stats = self.get_compression_stats()
+
+        if stats is None or self._compression_stats is None:
+            return
+
+        received = stats[0] - self._compression_stats[0]
+        received_compressed = stats[1] - self._compression_stats[1]
+
+        if received_compressed:
+            self.logger.info(
+                'Received %d bytes as %d compressed bytes (ratio %.2f) for mailbox %r',
+                received, received_compressed, received / received_compressed,
+                self.mailbox.pk)
+
+    def close(self, discard=False):
+        """Give the session back to the pool, `discard` logs out instead."""
+        if self._client is None:
+            return
+
+        self.log_compression_ratio()
+        client, self._client = self._client, None
+
+        if self.pool is None:
+            client.logout()
+        else:
+            self.pool.release(self.pool_key, client, discard=discard)
+
+    def copy(self):
+        """Return a new transport for the same mailbox, with its own connection.
+
+        Settings overridden on this instance apply to the copy too.
+        """
+        transport = self.__class__(
+            self.uri, self.mailbox, disable_cert_check=self._disable_cert_check)
+
+        for name in COPIED_ATTRIBUTES:
+            setattr(transport, name, getattr(self, name))
+
+        return transport
+
+    def get_folder_connections(self):
+        """Number of connections to sync folders with, within the provider limit."""
+        return max(1, min(self.folder_connections, self.get_max_connections()))
+
     def sync(self):
-        for imap_folder in self.get_folders_to_sync():
-            # TODO: normalize folder name? role isn't specific enough imho
-            # but maybe it is and should be used for normalization?
+        # Folder states that aren't stored together with messages are
+        # written with a single update once all folders are synced.
+        self._deferred_states = {}
+
+        try:
+            imap_folders = [
+                imap_folder for imap_folder in self.get_folders_to_sync()
+                if imap_folder.name not in self.skip_folders]
+            folders = self.get_folders(imap_folders)
+
+            if self.status_precheck:
+                imap_folders = self.get_changed_folders(imap_folders, folders)
+
+            if self.get_folder_connections() > 1 and len(imap_folders) > 1:
+                self.sync_folders_parallel(imap_folders, folders)
+            else:
+                for imap_folder in imap_folders:
+                    self.sync_folder(imap_folder, folders[imap_folder.name])
+
+            self.save_deferred_states()
+
+            if self.deduplicate and self.stored_messages:
+                self.save_raw_message_filter()
+        except Exception:
+            # The session might be in the middle of a command
+            self.close(discard=True)
+            raise
+
+        self.close()
+
+    def get_folders(self, imap_folders):
+        """Load the `MailboxFolder` of all `imap_folders` with a single query.
+
+        Missing folders are created.
+        """
+        folders = {
+            folder.name: folder
+            for folder in self.mailbox.folders.filter(
+                name__in=[imap_folder.name for imap_folder in imap_folders])}
+
+        for imap_folder in imap_folders:
+            if imap_folder.name not in folders:
+                folders[imap_folder.name], _ = self.mailbox.folders.get_or_create(
+                    name=imap_folder.name)
+
+        return folders
+
+    def get_changed_folders(self, imap_folders, folders):
+        """Return the `imap_folders` that changed since their last sync."""
+        statuses = self.get_folder_statuses([imap_folder.name for imap_folder in imap_folders])
+        changed = []
+
+        for imap_folder in imap_folders:
+            folder = folders[imap_folder.name]
+            status = statuses.get(imap_folder.name)
+
+            unchanged = (
+                status is not None and
+                not folder.pending_uids and
+                folder.uidvalidity == status.get(b'UIDVALIDITY') and
+                folder.uidnext == status.get(b'UIDNEXT') and
+                folder.highestmodseq == status.get(b'HIGHESTMODSEQ', folder.highestmodseq))
+
+            if not unchanged:
+                changed.append(imap_folder)
+
+        return changed
+
+    def get_folder_statuses(self, names):
+        """Return UIDNEXT, UIDVALIDITY and HIGHESTMODSEQ of the folders `names`.
+
+        Uses a single LIST-STATUS command if supported, otherwise all STATUS
+        commands are sent before waiting for the first response. Folders
+        the server didn't report on are missing from the result.
+        """
+        items = ['UIDNEXT', 'UIDVALIDITY']
+
+        if self.client.has_capability('CONDSTORE'):
+            items.append('HIGHESTMODSEQ')
+
+        items = '({})'.format(' '.join(items))
+        imap = self.client._imap
+        imap.untagged_responses.pop('STATUS', None)
+        listed = False
+
+        if self.client.has_capability('LIST-STATUS'):
+            try:
+                typ, _ = imap._simple_command(
+                    'LIST', '""', '"*"', 'RETURN', f'(STATUS {items})')
+                listed = typ == 'OK'
+            except imaplib.IMAP4.error:
+                pass
+
+            imap.untagged_responses.pop('LIST', None)
+
+        if not listed:
+            tags = [
+                imap._command('STATUS', self.client._normalise_folder(name), items)
+                for name in names]
+
+            for tag in tags:
+                try:
+                    imap._command_complete('STATUS', tag)
+                except imaplib.IMAP4.error:
+                    # That folder is synced like before
+                    pass
+
+        statuses = {}
+
+        for response in imap.untagged_responses.pop('STATUS', []):
+            name, status = parse_response([response])
+
+            if isinstance(name, int):
+                name = str(name)
+            elif self.client.folder_encode:
+                name = imap_utf7.decode(name)
+            else:
+                name = force_text(name)
+
+            statuses[name] = {
+                key.upper(): value for key, value in zip(status[::2], status[1::2])}
+
+        return statuses
+
+    def sync_folders_parallel(self, imap_folders, folders):
+        """Sync `imap_folders` over up to `folder_connections` connections.
+
+        The number of connections is capped by `get_max_connections`.
+
+        Every connection takes the next folder once it's done with the
+        previous one, in the order of `imap_folders`, so the inbox is
+        picked up first. This transport syncs in the calling thread, the
+        other connections each get a thread of their own.
+        """
+        queue = Queue()
+        for imap_folder in imap_folders:
+            queue.put((imap_folder, folders[imap_folder.name]))
+
+        workers = [
+            self.copy()
+            for _ in range(min(self.get_folder_connections(), len(imap_folders)) - 1)]
+
+        executor = ThreadPoolExecutor(max_workers=len(workers))
+        futures = [executor.submit(worker.sync_worker, queue) for worker in workers]
+
+        try:
+            self.sync_queued_folders(queue)
+        finally:
+            executor.shutdown(wait=True)
+
+        for future in futures:
+            # Re-raises the first error of a worker
+            future.result()
+
+        self.stored_messages += sum(worker.stored_messages for worker in workers)
+        self.backfill_pending = self.backfill_pending or any(
+            worker.backfill_pending for worker in workers)
+
+    def sync_queued_folders(self, queue):
+        while True:
+            try:
+                imap_folder, folder = queue.get_nowait()
+            except Empty:
+                return
+
+            self.sync_folder(imap_folder, folder)
+
+    def sync_worker(self, queue):
+        self._deferred_states = {}
+
+        try:
+            self.sync_queued_folders(queue)
+            self.save_deferred_states()
+        except Exception:
+            self.close(discard=True)
+            raise
+        else:
+            self.close()
+        finally:
+            # Database connections are per thread, don't leak them
+            connection.close()
+
+    def save_folder_state(self, folder, **folder_state):
+        """Store `folder_state`, deferred while `sync` is running."""
+        for field, value in folder_state.items():
+            setattr(folder, field, value)
+
+        if self._deferred_states is None:
+            MailboxFolder.objects.filter(pk=folder.pk).update(**folder_state)
+        else:
+            self._deferred_states.setdefault(folder.pk, {}).update(folder_state)
+
+    def save_deferred_states(self):
+        states, self._deferred_states = self._deferred_states, None
+
+        if not states:
+            return
+
+        fields = {field for state in states.values() for field in state}
+
+        MailboxFolder.objects.filter(pk__in=list(states)).update(**{
+            field: Case(
+                *[When(pk=pk, then=Value(state[field]))
+                  for pk, state in states.items() if field in state],
+                default=F(field),
+                output_field=MailboxFolder._meta.get_field(field))
+            for field in fields})
+
+    def sync_folder(self, imap_folder, folder=None):
+        # TODO: normalize folder name? role isn't specific enough imho
+        # but maybe it is and should be used for normalization?
+        if folder is None:
             folder, _ = self.mailbox.folders.get_or_create(name=imap_folder.name)
-            lastseenuid = folder.messages.aggregate(max_uid=Max('uid'))['max_uid'] or 0
 
-            # Begin imap session, please note that `self.client` isn't stateless
-            # but all following actions are executed against the actual folder
-            self.client.select_folder(folder.name, readonly=True)
+        # Highest UID up to which all messages are stored
+        lastseenuid = folder.checkpoint_uid or 0
+
+        # Begin imap session, please note that `self.client` isn't stateless
+        # but all following actions are executed against the actual folder
+        try:
+            folder_status = self.client.select_folder(folder.name, readonly=True)
+        except IMAPClientError:
+            # Most likely the folder is gone, don't rely on the cached list
+            self.invalidate_account_info()
+            raise
+
+        if b'UIDNEXT' not in folder_status:
+            # Some servers don't send UIDNEXT as part of the SELECT response
+            folder_status.update(self.client.folder_status(
+                folder.name, ['UIDNEXT', 'UIDVALIDITY']))
+
+        highestmodseq = folder_status.get(b'HIGHESTMODSEQ')
 
-            folder_status = self.client.folder_status(
-                folder.name, ['UIDNEXT', 'UIDVALIDITY'])
+        # The new state is marked in the database together with the
+        # last batch of messages.
+        folder_state = {
+            'uidnext': folder_status[b'UIDNEXT'],
+            'uidvalidity': folder_status[b'UIDVALIDITY'],
+            'highestmodseq': highestmodseq,
+        }
 
-            # TODO: Evaluate `highestmodseq`
-            need_sync = (
-                folder.uidnext != folder_status[b'UIDNEXT'] and
+        if (folder.uidvalidity is not None and
+                folder.uidvalidity != folder_status[b'UIDVALIDITY']):
+            # All UIDs we know about are invalid now
+            self.resync_folder(folder, **folder_state)
+            return
+
+        can_sync_changes = (
+            self.condstore_enabled and
+            highestmodseq is not None and
+            folder.highestmodseq is not None and
+            folder.uidvalidity == folder_status[b'UIDVALIDITY'])
+
+        if can_sync_changes:
+            if folder.highestmodseq == highestmodseq:
+                # Nothing changed since the last sync
+                return
+
+            self.sync_changes(folder, lastseenuid, **folder_state)
+        else:
+            # A previous sync didn't finish, continue with what's left
+            resume = (
+                folder.pending_uids and
+                folder.uidvalidity == folder_status[b'UIDVALIDITY'])
+
+            need_sync = resume or (
+                folder.uidnext != folder_status[b'UIDNEXT'] or
                 folder.uidvalidity != folder_status[b'UIDVALIDITY'])
 
             if not need_sync:
+                return
+
+            initial_sync = (
+                folder.uidvalidity is None and
+                not lastseenuid and
+                (self.initial_sync_days is not None or
+                 self.initial_sync_messages is not None))
+
+            if initial_sync:
+                self.sync_initial_window(folder, **folder_state)
+                return
+
+            if resume:
+                self.resume_folder(folder, lastseenuid, **folder_state)
+                return
+
+            new_messages = self.client.fetch(
+                f'{lastseenuid + 1}:*', self.metadata_fetch_items)
+
+            # `*` always matches the last message, even if its UID is
+            # lower than `lastseenuid`.
+            new_messages = {
+                uid: data for uid, data in new_messages.items()
+                if uid > lastseenuid}
+
+            self.fetch_messages(folder, new_messages, **folder_state)
+
+    def resume_folder(self, folder, lastseenuid, **folder_state):
+        """Continue an interrupted sync with its pending messages.
+
+        Messages that arrived in the meantime, from the UIDNEXT recorded by
+        the interrupted sync on, are fetched too. Messages it already
+        stored aren't fetched again and the order is kept.
+        """
+        pending = UidSet.from_sequence(folder.pending_uids)
+
+        if folder.uidnext is not None:
+            criteria = f'{pending},{folder.uidnext}:*'
+        else:
+            criteria = f'{pending},{pending.max + 1}:*'
+
+        new_messages = {
+            uid: data for uid, data in self.client.fetch(
+                criteria, self.metadata_fetch_items).items()
+            if uid > lastseenuid}
+
+        # An initial sync of the recent messages stored the newest first,
+        # the pending ones are all below them.
+        newest_first = folder.messages.filter(uid__gt=pending.max).exists()
+
+        # Everything below UIDNEXT is stored once the pending ones are.
+        self.fetch_messages(
+            folder, new_messages, newest_first=newest_first,
+            **dict(folder_state, pending_uids='',
+                   checkpoint_uid=folder_state['uidnext'] - 1))
+
+    def get_initial_window(self):
+        """Return the UIDs of the recent messages of the selected folder.
+
+        The window always contains all UIDs from its lowest one on, e.g
+        messages moved into the folder with an older INTERNALDATE, so that
+        the rest can be backfilled by UID.
+        """
+        uids = UidSet(self.client.search('ALL'))
+
+        if self.initial_sync_days is not None and uids:
+            since = timezone.now() - timedelta(days=self.initial_sync_days)
+            recent = UidSet(self.client.search(['SINCE', since.date()]))
+            uids = uids & UidSet.from_ranges([(recent.min, uids.max)]) if recent else UidSet()
+
+        if self.initial_sync_messages is not None:
+            uids = UidSet(islice(reversed(uids), self.initial_sync_messages))
+
+        return uids
+
+    def sync_initial_window(self, folder, **folder_state):
+        """Fetch the recent messages of a new folder, newest first.
+
+        Everything older is left to `backfill_folder`.
+        """
+        window = self.get_initial_window()
+        highest_uid = folder_state['uidnext'] - 1
+        backfill_uid = (window.min if window else highest_uid + 1) - 1
+
+        if backfill_uid > 0:
+            MailboxFolder.objects.filter(pk=folder.pk).update(backfill_uid=backfill_uid)
+            self.backfill_pending = True
+
+        new_messages = {}
+        if window:
+            new_messages = self.client.fetch(str(window), self.metadata_fetch_items)
+
+        # Everything up to UIDNEXT is either fetched now or backfilled later
+        self.fetch_messages(
+            folder, new_messages, newest_first=True,
+            checkpoint_uid=highest_uid, **folder_state)
+
+    def backfill_folder(self, folder):
+        """Fetch the next `backfill_batch_size` older messages, newest first.
+
+        Returns `True` if there are more messages to backfill.
+        """
+        if folder.backfill_uid is None:
+            return False
+
+        folder_status = self.client.select_folder(folder.name, readonly=True)
+
+        if folder_status[b'UIDVALIDITY'] != folder.uidvalidity:
+            # Left to the regular sync, `resync_folder` fetches everything
+            return False
+
+        uids = UidSet(self.client.search(['UID', f'1:{folder.backfill_uid}']))
+        batch = UidSet(islice(reversed(uids), self.backfill_batch_size))
+        remaining = uids - batch
+
+        if batch:
+            messages = self.client.fetch(str(batch), self.metadata_fetch_items)
+            messages = self.move_known_messages(folder, {
+                uid: data for uid, data in messages.items()
+                if uid <= folder.backfill_uid})
+
+            for uids in self.chunk_messages(messages, reverse=True):
+                data = self.fetch_chunk(uids, messages)
+
+                # Chunks are processed newest first
+                self.process_messages(folder, data, messages, backfill_uid=min(uids) - 1)
+
+        backfill_uid = remaining.max if remaining else None
+        MailboxFolder.objects.filter(pk=folder.pk).update(backfill_uid=backfill_uid)
+        folder.backfill_uid = backfill_uid
+
+        return backfill_uid is not None
+
+    def sync_changes(self, folder, lastseenuid, **folder_state):
+        """Fetch only the changes since the last known `highestmodseq`.
+
+        Requires CONDSTORE to be enabled. Flag changes of already known
+        messages are applied directly, new messages are fetched. If QRESYNC
+        is enabled the server additionally reports expunged messages
+        as part of the very same round trip.
+        """
+        modifiers = [f'CHANGEDSINCE {folder.highestmodseq}']
+
+        if self.qresync_enabled:
+            modifiers.append('VANISHED')
+
+        # Drop stale responses so that we only see the ones for this fetch
+        self.client._imap.untagged_responses.pop('VANISHED', None)
+
+        changed = self.client.fetch('1:*', self.metadata_fetch_items, modifiers)
+
+        vanished = UidSet()
+        for response in self.client._imap.untagged_responses.pop('VANISHED', []):
+            # Responses look like `(EARLIER) 41,43:116`
+            vanished |= UidSet.from_sequence(response.split()[-1])
+
+        # Delete range by range, `vanished` can be huge for `EARLIER`
+        for start, end in vanished.ranges():
+            folder.messages.filter(uid__range=(start, end)).delete_with_raw()
+
+        new_messages = {}
+        changed_metadata = {}
+
+        for uid, data in changed.items():
+            if uid in vanished:
+                continue
+
+            if uid > lastseenuid:
+                new_messages[uid] = data
+            else:
+                changed_metadata[uid] = data
+
+        self.update_metadata(folder, changed_metadata)
+        self.fetch_messages(folder, new_messages, **folder_state)
+
+    def resync_folder(self, folder, **folder_state):
+        """Resynchronize a folder after its UIDVALIDITY changed.
+
+        The remote UIDs are diffed against the stored ones. Stored messages
+        are recognized by their Message-ID, size and internal date so that
+        they don't have to be downloaded again, only messages we don't know
+        yet are fetched. Stored messages that are gone are deleted.
+
+        The identities are fetched and matched in batches of
+        `resync_batch_size` UIDs. Matched messages are parked at their
+        negative new UID right away, so that only the new messages are
+        kept in memory until the end.
+        """
+        remote = UidSet(self.client.search('ALL'))
+        remaining = remote
+        new_messages = {}
+
+        with transaction.atomic():
+            while remaining:
+                batch = UidSet(islice(remaining, self.resync_batch_size))
+                remaining -= batch
+
+                new_messages.update(self.resync_batch(folder, batch, remaining))
+
+            # Whatever wasn't matched is gone, the others are moved to
+            # their new UIDs.
+            folder.messages.filter(uid__gt=0).delete_with_raw()
+            folder.messages.filter(uid__lt=0).update(uid=F('uid') * -1)
+
+            MailboxFolder.objects.filter(pk=folder.pk).update(
+                uidvalidity=folder_state['uidvalidity'],
+                highestmodseq=None,
+                checkpoint_uid=None,
+                pending_uids='',
+                backfill_uid=None)
+
+        # Everything up to the highest remote UID is stored once the
+        # new messages are fetched.
+        folder_state['checkpoint_uid'] = remote.max if remote else 0
+        self.fetch_messages(folder, new_messages, **folder_state)
+
+    def resync_batch(self, folder, batch, remaining):
+        """Match the remote messages of `batch` against the stored ones.
+
+        Stored messages that are recognized get the negative of their new
+        UID, negative UIDs are used temporarily to satisfy the unique
+        constraint. Returns the metadata of the messages that are new.
+        """
+        metadata = self.client.fetch(str(batch), RESYNC_FETCH_ITEMS)
+
+        def identify(message_id, size, internal_date):
+            return (message_id.strip(), size, internal_date)
+
+        remote_keys = {
+            uid: identify(
+                get_header_field(data, 'message-id'),
+                data[b'RFC822.SIZE'], data[b'INTERNALDATE'])
+            for uid, data in metadata.items()}
+
+        if not remote_keys:
+            return {}
+
+        # Stored messages with the same UID or the same size and date,
+        # the ones that were matched already have a negative UID.
+        stored = folder.messages.filter(uid__gt=0).filter(
+            Q(uid__in=list(remote_keys)) |
+            Q(size__in={key[1] for key in remote_keys.values()},
+              internal_date__in={key[2] for key in remote_keys.values()}))
+
+        local_keys = {}
+        for pk, uid, message_id, size, internal_date in stored.values_list(
+                'pk', 'uid', 'message_id', 'size', 'internal_date'):
+            local_keys[uid] = (pk, identify(message_id, size, internal_date))
+
+        # Most servers keep their numbering, messages with the same UID
+        # and identity are matched first.
+        moved = {
+            local_keys[uid][0]: uid for uid, key in remote_keys.items()
+            if uid in local_keys and local_keys[uid][1] == key}
+
+        # Stored messages whose UID comes in a later batch are taken last,
+        # they're likely still at the same UID.
+        candidates = {}
+        for uid in sorted(local_keys, key=lambda uid: uid not in remaining):
+            pk, key = local_keys[uid]
+
+            if pk not in moved:
+                candidates.setdefault(key, []).append(pk)
+
+        unchanged = set(moved.values())
+        new_messages = {}
+        for uid, key in remote_keys.items():
+            if uid in unchanged:
                 continue
 
-            # TODO:
-            # if folder.uidvalidity != folder_status[b'UIDVALIDITY']:
-            #     # full resync
+            pks = candidates.get(key)
+
+            if pks:
+                moved[pks.pop()] = uid
+            else:
+                new_messages[uid] = metadata[uid]
+
+        moved = list(moved.items())
+
+        for offset in range(0, len(moved), self.persist_batch_size):
+            chunk = moved[offset:offset + self.persist_batch_size]
+
+            folder.messages.filter(pk__in=[pk for pk, uid in chunk]).update(
+                uid=Case(
+                    *[When(pk=pk, then=Value(-uid)) for pk, uid in chunk],
+                    output_field=BigIntegerField()))
+
+        self.update_flags(folder, {
+            -uid: data[b'FLAGS'] for uid, data in metadata.items()
+            if uid not in new_messages})
+
+        return new_messages
+
+    def update_metadata(self, folder, changed):
+        """Store the changed metadata of already known messages."""
+        self.update_flags(folder, {uid: data[b'FLAGS'] for uid, data in changed.items()})
+
+    def update_flags(self, folder, changed):
+        """Store the flags of already known messages."""
+        changed_flags = {}
+
+        for uid, flags in changed.items():
+            flags = tuple(force_text(flag) for flag in flags)
+            changed_flags.setdefault(flags, []).append(uid)
+
+        # Group by flags so that we issue one update per distinct set
+        # of flags instead of one per message.
+        for flags, uids in changed_flags.items():
+            folder.messages.filter(uid__in=uids).update(flags=list(flags))
+
+    def fetch_messages(self, folder, messages, newest_first=False, **folder_state):
+        """Fetch and process the full messages for `messages`.
+
+        `messages` maps UIDs to the metadata of our first fetch. Bodies are
+        requested in chunks of at most `fetch_batch_bytes` according to
+        `RFC822.SIZE` and every chunk is processed before the next one is
+        requested to keep memory usage bounded.
+
+        `folder_state` is stored together with the last chunk. Until then
+        every chunk records a checkpoint so that an interrupted sync can
+        be resumed with the pending UIDs only.
+        """
+        messages = self.move_known_messages(folder, messages)
+        chunks = list(self.chunk_messages(messages, reverse=newest_first))
+
+        if not chunks:
+            self.save_folder_state(folder, **folder_state)
+            return
+
+        pending = UidSet(messages)
+        highest_uid = pending.max
+        checkpoint = {
+            'pending_uids': str(pending),
+            'checkpoint_uid': pending.min - 1,
+        }
+
+        if 'uidvalidity' in folder_state:
+            # Required to validate the checkpoint when resuming
+            checkpoint['uidvalidity'] = folder_state['uidvalidity']
+
+        if 'uidnext' in folder_state:
+            # Messages from here on are fetched when resuming
+            checkpoint['uidnext'] = folder_state['uidnext']
+
+        self.persist_messages(folder, [], **checkpoint)
+
+        # With a `parse_executor` a chunk is parsed while the next one is
+        # fetched and stored afterwards, still in order.
+        parsing = None
+
+        for index, uids in enumerate(chunks):
+            data = self.fetch_chunk(uids, messages)
+
+            if parsing is not None:
+                self.store_messages(folder, *parsing)
+                parsing = None
+
+            pending -= UidSet(uids)
+
+            checkpoint = {
+                'pending_uids': str(pending),
+                'checkpoint_uid': pending.min - 1 if pending else highest_uid,
+            }
+
+            if index == len(chunks) - 1:
+                checkpoint.update(folder_state)
+
+            if self.parse_executor is None:
+                self.process_messages(folder, data, messages, **checkpoint)
+            else:
+                parsing = (self.parse_messages(data), messages, checkpoint)
+
+        if parsing is not None:
+            self.store_messages(folder, *parsing)
+
+    def fetch_bodies(self, folder, uids=None):
+        """Download the bodies of messages stored by a headers-first sync.
+
+        Fetches all missing bodies of `folder` or only the ones of `uids`.
+        Only the body fields are updated, the metadata stored by the sync
+        (attachments, Gmail labels...) is kept.
+        """
+        missing = folder.messages.filter(body_fetched=False)
+
+        if uids is not None:
+            missing = missing.filter(uid__in=uids)
+
+        messages = {}
+        for uid, size in missing.values_list('uid', 'size'):
+            messages[uid] = {}
+
+            if size is not None:
+                messages[uid][b'RFC822.SIZE'] = size
+
+        if not messages:
+            return
+
+        self.client.select_folder(folder.name, readonly=True)
 
-            new_message_uids = self.client.fetch(
-                f'{lastseenuid + 1}:*',
-                (
-                    'FLAGS', 'UID', 'BODYSTRUCTURE', 'INTERNALDATE',
-                    'RFC822.SIZE'
-                )
-            )
+        if self.skip_attachments:
+            # Required to tell the text sections from attachments
+            for uid, data in self.client.fetch(
+                    str(UidSet(messages)), ('BODYSTRUCTURE',)).items():
+                if uid in messages and b'BODYSTRUCTURE' in data:
+                    messages[uid][b'BODYSTRUCTURE'] = data[b'BODYSTRUCTURE']
 
-            print(new_message_uids)
+        for chunk in self.chunk_by_size(messages):
+            data = self.fetch_contents(chunk, messages)
+            bodies = [
+                Message.from_parsed(
+                    parsed, folder=folder, uid=uid, body_fetched=body_fetched)
+                for uid, body_fetched, parsed in self.parse_messages(data)]
 
-            message_id_batch = self.uid_sequence(new_message_uids.keys())
+            self.persist_messages(folder, bodies, update_fields=MESSAGE_BODY_FIELDS)
 
-            print('fetching', message_id_batch)
+    def move_known_messages(self, folder, messages):
+        """Hook to re-assign messages that are already stored elsewhere.
 
-            # TODO:
-            # Add support for GMail specific flags: X-GM-THRID, X-GM-MSGID,
-            # X-GM-LABELS
-            data = self.client.fetch(
-                message_id_batch,
-                ('BODY.PEEK[]',)
-            )
+        Returns the messages that still have to be fetched.
+        """
+        return messages
+
+    def chunk_messages(self, messages, reverse=False):
+        if not self.headers_first:
+            return self.chunk_by_size(messages, reverse=reverse)
+
+        uids = sorted(messages, reverse=reverse)
+        return (
+            uids[offset:offset + self.persist_batch_size]
+            for offset in range(0, len(uids), self.persist_batch_size))
+
+    def fetch_chunk(self, uids, messages):
+        if self.headers_first:
+            return self.client.fetch(str(UidSet(uids)), HEADER_FETCH_ITEMS)
+        return self.fetch_contents(uids, messages)
+
+    def fetch_contents(self, uids, messages):
+        """Fetch the messages of `uids`, skipping attachments if enabled.
+
+        Fetch items apply to all messages of a FETCH command, so messages
+        are grouped by the sections they need.
+        """
+        groups = OrderedDict()
+
+        for uid in uids:
+            sections = None
+
+            if self.skip_attachments:
+                sections = get_text_sections(messages[uid].get(b'BODYSTRUCTURE'))
+
+            groups.setdefault(sections, []).append(uid)
+
+        data = {}
+
+        for sections, group in groups.items():
+            if sections is None:
+                fetch_items = BODY_FETCH_ITEMS
+            else:
+                fetch_items = get_partial_fetch_items(sections)
+
+            data.update(self.client.fetch(str(UidSet(group)), fetch_items))
+
+        return data
+
+    def fetch_attachment(self, message, section):
+        """Download and decode a single attachment of `message`."""
+        self.client.select_folder(message.folder.name, readonly=True)
+
+        data = self.client.fetch(
+            [message.uid], (f'BODY.PEEK[{section}.MIME]', f'BODY.PEEK[{section}]'))
+        data = data.get(message.uid)
+
+        if data is None:
+            # The message is gone in the meantime
+            return None
+
+        part = email.message_from_bytes(
+            data[f'BODY[{section}.MIME]'.encode()] + data[f'BODY[{section}]'.encode()])
+        return part.get_payload(decode=True)
+
+    def process_messages(self, folder, data, messages, **folder_state):
+        """Parse fetched messages, or just their headers, and persist them."""
+        self.store_messages(folder, self.parse_messages(data), messages, folder_state)
+
+    def parse_messages(self, data):
+        """Start parsing the messages of a fetch response.
+
+        Returns ``(uid, body_fetched, parsed)`` tuples, lazily if parsing
+        runs on the `parse_executor`.
+        """
+        uids = list(data)
+        contents = [get_fetched_content(data[uid]) for uid in uids]
+        parsed_messages = self.parse_emails([content for content, _ in contents])
+
+        # Partial messages are stored with their real header
+        parsed_messages = map(
+            restore_partial_header, parsed_messages,
+            [get_partial_header(data[uid]) for uid in uids])
+
+        return zip(uids, (complete for _, complete in contents), parsed_messages)
+
+    def store_messages(self, folder, parsed_messages, messages, folder_state):
+        """Persist the result of `parse_messages` with `folder_state`."""
+        new_mail = []
+
+        for uid, body_fetched, parsed in parsed_messages:
+            metadata = messages.get(uid, {})
+
+            if not parsed.get('parsed_date') and metadata.get(b'INTERNALDATE'):
+                parsed['parsed_date'] = metadata[b'INTERNALDATE']
+
+            new_mail.append(Message.from_parsed(
+                parsed,
+                folder=folder,
+                uid=uid,
+                body_fetched=body_fetched,
+                **self.get_metadata_fields(metadata)
+            ))
+
+        self.persist_messages(folder, new_mail, **folder_state)
+
+    def get_metadata_fields(self, metadata):
+        """Map the metadata of a fetch response to `Message` fields."""
+        return {
+            'flags': [force_text(flag) for flag in metadata.get(b'FLAGS', ())],
+            'size': metadata.get(b'RFC822.SIZE'),
+            'internal_date': metadata.get(b'INTERNALDATE'),
+            'attachments': get_attachments(metadata.get(b'BODYSTRUCTURE')),
+        }
+
+    def persist_messages(self, folder, messages, update_fields=None, **folder_state):
+        """Store `messages` and update the folder sync state atomically.
+
+        Only the `update_fields` of already stored messages are updated if
+        given.
+        """
+        with transaction.atomic():
+            if messages and self.deduplicate:
+                RawMessage.objects.deduplicate(
+                    messages, seen=self.get_raw_message_filter())
+
+            if messages:
+                Message.objects.upsert(
+                    messages, batch_size=self.persist_batch_size,
+                    update_fields=update_fields)
+                self.stored_messages += len(messages)
+
+            if folder_state:
+                MailboxFolder.objects.filter(pk=folder.pk).update(**folder_state)
+
+        for field, value in folder_state.items():
+            setattr(folder, field, value)
+
+        if self.heartbeat is not None:
+            self.heartbeat()
+
+    def get_raw_message_filter(self):
+        """Return the `BloomFilter` of raw messages stored for the mailbox.
+
+        Taken from memory or the shared cache if possible, otherwise built
+        from the database. Rebuilt bigger once it's full so the false
+        positive rate stays low. A filter that misses recent keys only
+        costs an insert that turns out to be a conflict.
+        """
+        pk = self.mailbox.pk
+
+        with RAW_MESSAGE_FILTERS_LOCK:
+            seen = RAW_MESSAGE_FILTERS.get(pk)
+            if seen is not None:
+                RAW_MESSAGE_FILTERS.move_to_end(pk)
+
+        if seen is None:
+            seen = cache.get(RAW_MESSAGE_FILTER_CACHE_KEY.format(pk))
 
-            for uid, msg in data.items():
-                print(self.get_email_from_bytes(msg[b'BODY[]']))
+        if seen is None or seen.is_full:
+            keys = RawMessage.objects.filter(
+                messages__folder__mailbox=self.mailbox
+            ).values_list('message_id', 'body_hash').distinct()
 
-            # We're done with the update, mark the new state in the database
-            self.mailbox.folders.filter(name=imap_folder.name).update(
-                uidnext=folder_status[b'UIDNEXT'],
-                uidvalidity=folder_status[b'UIDVALIDITY']
-            )
+            seen = BloomFilter(capacity=max(10000, keys.count() * 2))
+
+            for key in keys.iterator():
+                seen.add(get_raw_message_key(*key))
+
+            self.save_raw_message_filter(seen)
+
+        with RAW_MESSAGE_FILTERS_LOCK:
+            RAW_MESSAGE_FILTERS[pk] = seen
+
+            while len(RAW_MESSAGE_FILTERS) > MAX_RAW_MESSAGE_FILTERS:
+                RAW_MESSAGE_FILTERS.popitem(last=False)
+
+        return seen
+
+    def save_raw_message_filter(self, seen=None):
+        """Share the raw message filter of the mailbox with other workers."""
+        if seen is None:
+            seen = RAW_MESSAGE_FILTERS.get(self.mailbox.pk)
+
+        if seen is not None:
+            cache.set(
+                RAW_MESSAGE_FILTER_CACHE_KEY.format(self.mailbox.pk), seen,
+                RAW_MESSAGE_FILTER_CACHE_TTL)
+
+    def chunk_by_size(self, messages, reverse=False):
+        """Split `messages` into UID lists of at most `fetch_batch_bytes`.
+
+        A single message bigger than the budget gets a chunk of its own.
+        """
+        chunk, chunk_size = [], 0
+
+        for uid in sorted(messages, reverse=reverse):
+            size = self.get_fetch_size(messages[uid])
+
+            if chunk and chunk_size + size > self.fetch_batch_bytes:
+                yield chunk
+                chunk, chunk_size = [], 0
+
+            chunk.append(uid)
+            chunk_size += size
+
+        if chunk:
+            yield chunk
+
+    def get_fetch_size(self, metadata):
+        """Estimate the bytes `fetch_contents` downloads for a message."""
+        size = metadata.get(b'RFC822.SIZE', 0)
+        structure = metadata.get(b'BODYSTRUCTURE')
+
+        if self.skip_attachments and get_text_sections(structure) is not None:
+            size -= sum(info['size'] or 0 for info in get_attachments(structure))
+
+        return max(size, 0)
 
     def get_folders_to_sync(self):
         to_sync = []
@@ -134,7 +1313,6 @@ class ImapTransport(EmailTransport):
             _folder_names.setdefault(folder.role, [])
             _folder_names[folder.role].append(folder)
 
-        # TODO: for gmail make sure that we only sync `all`, `spam` and `trash`.
         # Sync `inbox` folder first, then others.
         to_sync = _folder_names['inbox']
         for role, folders in _folder_names.items():
@@ -144,7 +1322,48 @@ class ImapTransport(EmailTransport):
 
         return to_sync
 
+    def get_account_info(self):
+        """Return the capabilities, personal namespace and folders of the account.
+
+        The result is cached for `account_cache_ttl` seconds so that polls
+        don't need to LIST all folders. It's refreshed early once the
+        server announces different capabilities, which usually come for
+        free with the login response.
+        """
+        capabilities = sorted(force_text(item) for item in self.client.capabilities())
+        key = ACCOUNT_CACHE_KEY.format(self.mailbox.pk)
+        info = cache.get(key)
+
+        if info is None or info['capabilities'] != capabilities:
+            namespace = None
+
+            if 'NAMESPACE' in capabilities:
+                namespace = self.client.namespace().personal
+
+            info = {
+                'capabilities': capabilities,
+                'namespace': namespace,
+                'folders': [tuple(folder) for folder in self.list_folders()],
+            }
+
+            cache.set(key, info, self.account_cache_ttl)
+
+        return info
+
+    def invalidate_account_info(self):
+        cache.delete(ACCOUNT_CACHE_KEY.format(self.mailbox.pk))
+
+    def namespace(self):
+        """Return the personal namespaces as ``(prefix, delimiter)`` pairs.
+
+        `None` if the server doesn't support NAMESPACE.
+        """
+        return self.get_account_info()['namespace']
+
     def folders(self):
+        return [ImapFolder(*folder) for folder in self.get_account_info()['folders']]
+
+    def list_folders(self):
         """Fetch the list of folders for the account from the remote."""
         _folder_list = self.client.list_folders()
 
@@ -166,48 +1385,9 @@ class ImapTransport(EmailTransport):
                 for flag in flags:
                     role = DEFAULT_FOLDER_FLAGS.get(flag)
 
+                    if role is not None:
+                        break
+
             retval.append(ImapFolder(name=name, role=role))
 
         return retval
-
-    def uid_sequence(self, uidlist):
-        """Collapse UID lists into shorter sequence sets
-
-        E.g [1,2,3,4,5,10,12,13] will return "1:5,10,12:13".
-
-        This function sorts the list, and only collapses if subsequent entries
-        form a range.
-
-        :returns: The collapsed UID list as string.
-        """
-
-        def getrange(start, end):
-            if start == end:
-                return str(start)
-            return f'{start}:{end}'
-
-        if not uidlist:
-            return ''
-
-        start, end = None, None
-        retval = []
-
-        # Force items to be longs and sort them
-        sorted_uids = sorted(map(int, uidlist))
-
-        for item in sorted_uids:
-            item = int(item)
-            if start is None:
-                # first item
-                start, end = item, item
-            elif item == end + 1:
-                # Next item in a range
-                end = item
-            else:
-                # Starting a new range
-                retval.append(getrange(start, end))
-                start, end = item, item
-
-        # Add final range/item
-        retval.append(getrange(start, end))
-        return ','.join(retval)
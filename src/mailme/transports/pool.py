@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import OrderedDict
+
+from mailme.utils.logging import logged
+
+
+# Used for providers without a `max_connections` entry in `PROVIDERS`
+DEFAULT_MAX_CONNECTIONS = 10
+
+
+class ConnectionLimitError(Exception):
+    """Raised if no connection became available in time."""
+
+
+@logged
+class ConnectionPool(object):
+    """Keeps logged in `IMAPClient` sessions alive between syncs.
+
+    Sessions are keyed by the credentials of a mailbox. An idle session is
+    checked with NOOP before it's handed out again. Idle sessions are
+    evicted once they're idle for `max_idle_time` seconds, older than
+    `max_age` seconds or if there are more than `max_idle` of them, least
+    recently used first.
+    """
+
+    def __init__(self, max_idle=1000, max_idle_time=10 * 60, max_age=60 * 60,
+                 timeout=30):
+        self.max_idle = max_idle
+        self.max_idle_time = max_idle_time
+        self.max_age = max_age
+        self.timeout = timeout
+
+        # (key, id(client)) -> (client, last used), in LRU order
+        self._idle = OrderedDict()
+        self._active = {}
+        self._created = {}
+        self._condition = threading.Condition()
+
+    def acquire(self, key, connect, max_connections=DEFAULT_MAX_CONNECTIONS):
+        """Return a logged in session for `key`, `connect` creates new ones.
+
+        At most `max_connections` sessions per `key` are in use at the same
+        time, if that limit is reached we wait for a session to be released.
+        """
+        deadline = time.monotonic() + self.timeout
+        expired = []
+
+        try:
+            with self._condition:
+                while True:
+                    client = self._pop_idle(key, expired)
+
+                    if client is not None or self._active.get(key, 0) < max_connections:
+                        self._active[key] = self._active.get(key, 0) + 1
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._condition.wait(remaining):
+                        raise ConnectionLimitError(
+                            f'No connection available within {self.timeout} seconds')
+        finally:
+            # Talk to the server outside of the lock
+            for expired_client in expired:
+                self._logout(expired_client)
+
+        if client is not None and not self._is_alive(client):
+            self._forget(client)
+            client = None
+
+        if client is None:
+            try:
+                client = connect()
+            except Exception:
+                self._release_slot(key)
+                raise
+
+            self._created[id(client)] = time.monotonic()
+
+        return client
+
+    def release(self, key, client, discard=False):
+        """Return `client` to the pool, `discard` closes it instead.
+
+        Sessions should be discarded if an error left them in an unknown
+        state.
+        """
+        now = time.monotonic()
+        expired = now - self._created.get(id(client), now) > self.max_age
+
+        evicted = []
+
+        if discard or expired:
+            self._logout(client)
+        else:
+            with self._condition:
+                self._idle[(key, id(client))] = (client, now)
+
+                while len(self._idle) > self.max_idle:
+                    _, (idle_client, _) = self._idle.popitem(last=False)
+                    evicted.append(idle_client)
+
+        self._release_slot(key)
+
+        # Talk to the server outside of the lock
+        for evicted_client in evicted:
+            self._logout(evicted_client)
+
+    def clear(self):
+        with self._condition:
+            idle, self._idle = self._idle, OrderedDict()
+
+        for client, _ in idle.values():
+            self._logout(client)
+
+    def _pop_idle(self, key, expired):
+        # Most recently used sessions first, they're most likely still alive.
+        # Expired sessions are added to `expired` to be logged out once the
+        # lock is released.
+        now = time.monotonic()
+
+        for idle_key in reversed(list(self._idle)):
+            if idle_key[0] != key:
+                continue
+
+            client, last_used = self._idle.pop(idle_key)
+
+            if now - last_used > self.max_idle_time:
+                expired.append(client)
+                continue
+
+            return client
+
+        return None
+
+    def _release_slot(self, key):
+        with self._condition:
+            self._active[key] -= 1
+
+            if not self._active[key]:
+                del self._active[key]
+
+            self._condition.notify()
+
+    def _is_alive(self, client):
+        try:
+            client.noop()
+        except Exception:
+            return False
+        return True
+
+    def _forget(self, client):
+        self._created.pop(id(client), None)
+
+        try:
+            client.shutdown()
+        except Exception:
+            pass
+
+    def _logout(self, client):
+        self._created.pop(id(client), None)
+
+        try:
+            client.logout()
+        except Exception as exc:
+            self.logger.info('Could not close the connection cleanly: %s', exc)
+
+
+connection_pool = ConnectionPool()
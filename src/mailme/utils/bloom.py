@@ -0,0 +1,49 @@
+import hashlib
+import math
+
+from django.utils.encoding import force_bytes
+
+
+class BloomFilter(object):
+    """A set that can only tell for sure that it doesn't contain a key.
+
+    Keys that were added are always found, others are falsely reported as
+    contained with a probability of about `error_rate`, as long as no more
+    than `capacity` keys are added.
+    """
+    __slots__ = ('capacity', 'size', 'hashes', 'bits', 'count')
+
+    def __init__(self, capacity=10000, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing, two 64 bit halves of a single digest
+        digest = hashlib.blake2b(force_bytes(key), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+
+        for index in range(self.hashes):
+            yield (first + index * second) % self.size
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key))
+
+    def __len__(self):
+        """Number of added keys, including duplicates."""
+        return self.count
+
+    @property
+    def is_full(self):
+        return self.count > self.capacity
@@ -0,0 +1,91 @@
+from django.utils.encoding import force_text
+
+from mailme.utils.parser import decode_mail_header
+
+
+def walk(structure, section=''):
+    """Yield ``(section, part)`` for all non-multipart parts of a BODYSTRUCTURE.
+
+    Sections are numbered like IMAP expects them in ``BODY[<section>]``,
+    e.g ``1.2``. Attached messages aren't descended into.
+    """
+    if not structure.is_multipart:
+        yield section or '1', structure
+        return
+
+    for index, part in enumerate(structure[0], 1):
+        yield from walk(part, f'{section}.{index}' if section else str(index))
+
+
+def get_params(params):
+    """Turn a ``(key, value, key, value)`` parameter list into a dict."""
+    params = params or ()
+    return {
+        force_text(key).lower(): decode_mail_header(force_text(value))
+        for key, value in zip(params[::2], params[1::2])}
+
+
+def get_part_info(section, part):
+    maintype = force_text(part[0]).lower()
+    subtype = force_text(part[1]).lower()
+    params = get_params(part[2])
+
+    # Position of the extension data depends on the type of the part,
+    # text parts have a line count, attached messages their envelope,
+    # body structure and line count.
+    if maintype == 'text':
+        extension = 8
+    elif (maintype, subtype) == ('message', 'rfc822'):
+        extension = 10
+    else:
+        extension = 7
+
+    disposition, disposition_params = None, {}
+    if len(part) > extension + 1 and part[extension + 1]:
+        disposition = force_text(part[extension + 1][0]).lower()
+        disposition_params = get_params(part[extension + 1][1])
+
+    return {
+        'section': section,
+        'content_type': f'{maintype}/{subtype}',
+        'charset': params.get('charset'),
+        'encoding': force_text(part[5] or '').lower() or None,
+        'size': part[6],
+        'disposition': disposition,
+        'filename': disposition_params.get('filename') or params.get('name'),
+    }
+
+
+def is_text_body(info):
+    return (
+        info['content_type'] in ('text/plain', 'text/html') and
+        info['disposition'] != 'attachment')
+
+
+def get_text_sections(structure):
+    """Return the sections of the text bodies of a multipart message.
+
+    Returns `None` if the message should be fetched as a whole, because it
+    isn't multipart or has no parts besides the text bodies.
+    """
+    if structure is None or not structure.is_multipart:
+        return None
+
+    parts = [get_part_info(section, part) for section, part in walk(structure)]
+    sections = tuple(info['section'] for info in parts if is_text_body(info))
+
+    if len(sections) == len(parts):
+        return None
+
+    return sections
+
+
+def get_attachments(structure):
+    """Return the metadata of all parts that aren't text bodies."""
+    if structure is None:
+        return []
+
+    return [
+        info for info in (
+            get_part_info(section, part) for section, part in walk(structure))
+        if not is_text_body(info)]
@@ -1,10 +1,13 @@
 # Loosely based on imbox <https://github.com/martinrusev/imbox>
-import io
 import re
 import email
 import base64
+import binascii
 import quopri
+from collections.abc import MutableMapping
 from email.header import decode_header
+from email.parser import BytesFeedParser, BytesHeaderParser, HeaderParser
+from tempfile import SpooledTemporaryFile
 
 import chardet
 from django.utils.encoding import force_text, force_bytes
@@ -12,6 +15,65 @@ from django.utils.encoding import force_text, force_bytes
 
 RE_PARAM = re.compile(r'=\?((?:\w|-)+)\?(Q|B)\?(.+)\?=')
 
+# Upper bound of bytes chardet looks at, detection is slow and a sample
+# around the undecodable bytes is as good as the whole text.
+CHARDET_SAMPLE_SIZE = 16 * 1024
+
+# Attachments bigger than this are moved from memory to a temporary file
+ATTACHMENT_SPOOL_SIZE = 1024 * 1024
+
+# Characters of a base64 payload decoded at once by `write_payload`
+DECODE_CHUNK_SIZE = 64 * 1024
+
+RE_NOT_BASE64 = re.compile(r'[^A-Za-z0-9+/=]')
+
+RE_HEADER_END = re.compile(r'\r?\n\r?\n')
+RE_HEADER_END_BYTES = re.compile(br'\r?\n\r?\n')
+
+
+def decode_bytes(content, charset='utf-8'):
+    """
+    Decode `content` with `charset`, falling back to a detected charset.
+    """
+    try:
+        return content.decode(charset)
+    except LookupError:
+        # Unknown charset, try again with the default
+        return decode_bytes(content)
+    except UnicodeDecodeError as exc:
+        start = max(0, exc.start - CHARDET_SAMPLE_SIZE // 2)
+        sample = content[start:start + CHARDET_SAMPLE_SIZE]
+
+    detected = chardet.detect(sample)['encoding'] or 'utf-8'
+
+    try:
+        return content.decode(detected, errors='replace')
+    except LookupError:
+        return content.decode('utf-8', errors='replace')
+
+
+def decode_raw_header(value):
+    """
+    Decode a raw header value of a message parsed from bytes.
+
+    Non-ASCII bytes are kept as surrogates by `email.message_from_bytes`,
+    they're decoded like a text part without declared charset. Values
+    parsed from a string are returned as they are.
+    """
+    try:
+        raw = value.encode('ascii', 'surrogateescape')
+    except UnicodeEncodeError:
+        return value
+
+    return decode_bytes(raw)
+
+
+def get_headers(message):
+    """
+    Return all ``(name, value)`` header pairs of a message as strings.
+    """
+    return [(name, decode_raw_header(value)) for name, value in message.raw_items()]
+
 
 def decode_mail_header(value, default_charset='us-ascii'):
     """
@@ -36,7 +98,10 @@ def get_mail_addresses(message, header_name):
     """
     Retrieve all email addresses from one message header.
     """
-    headers = [h for h in message.get_all(header_name, [])]
+    header_name = header_name.lower()
+    headers = [
+        value for name, value in get_headers(message)
+        if name.lower() == header_name]
     addresses = email.utils.getaddresses(headers)
 
     for index, (address_name, address_email) in enumerate(addresses):
@@ -72,6 +137,36 @@ def decode_param(param):
     return name, v
 
 
+def write_payload(message_part, fobj):
+    """
+    Decode the payload of `message_part` into `fobj`, returns the size.
+
+    Base64, the encoding of almost all attachments, is decoded piece by
+    piece so that the decoded payload is never in memory as a whole.
+    """
+    encoding = str(message_part.get('Content-Transfer-Encoding', '')).strip().lower()
+
+    if encoding == 'base64':
+        payload = message_part.get_payload()
+        size, rest = 0, ''
+
+        try:
+            for offset in range(0, len(payload), DECODE_CHUNK_SIZE):
+                chunk = rest + RE_NOT_BASE64.sub(
+                    '', payload[offset:offset + DECODE_CHUNK_SIZE])
+                usable = len(chunk) - len(chunk) % 4
+                rest = chunk[usable:]
+                size += fobj.write(binascii.a2b_base64(chunk[:usable]))
+        except binascii.Error:
+            # Broken padding, let `email` do its best on the whole payload
+            fobj.seek(0)
+            fobj.truncate()
+        else:
+            return size
+
+    return fobj.write(message_part.get_payload(decode=True) or b'')
+
+
 def parse_attachment(message_part):
     # Check again if this is a valid attachment
     content_disposition = message_part.get('Content-Disposition', None)
@@ -79,12 +174,14 @@ def parse_attachment(message_part):
         dispositions = content_disposition.strip().split(';')
 
         if dispositions[0].lower() in ['attachment', 'inline']:
-            file_data = message_part.get_payload(decode=True)
+            content = SpooledTemporaryFile(max_size=ATTACHMENT_SPOOL_SIZE)
+            size = write_payload(message_part, content)
+            content.seek(0)
 
             attachment = {
                 'content-type': message_part.get_content_type(),
-                'size': len(file_data),
-                'content': io.BytesIO(file_data)
+                'size': size,
+                'content': content
             }
             filename = message_part.get_param('name')
             if filename:
@@ -106,66 +203,197 @@ def parse_attachment(message_part):
 
 def decode_content(message):
     content = message.get_payload(decode=True)
-    charset = message.get_content_charset('utf-8')
-    try:
-        return content.decode(charset)
-    except UnicodeDecodeError:
-        # Scenarios like no-breaking space in utf-8 which should be latin-1
-        # encoding :-/
-        charset = chardet.detect(content)
-        return content.decode(charset['encoding'])
-    except AttributeError:
+
+    if content is None:
         return content
 
+    # Scenarios like no-breaking space in utf-8 which should be latin-1
+    # encoding are handled by `decode_bytes` :-/
+    return decode_bytes(content, message.get_content_charset('utf-8'))
+
 
 def parse_email(raw_email):
+    """
+    Parse a raw message, either bytes or a string.
+
+    Bytes are parsed as they are, only the text parts get decoded, each
+    with its own charset.
+    """
     if isinstance(raw_email, bytes):
-        try:
-            raw_email = force_text(raw_email)
-        except UnicodeDecodeError:
-            raw_email = raw_email.decode(chardet.detect(raw_email)['encoding'])
+        message = email.message_from_bytes(raw_email)
+        original = decode_bytes(raw_email)
+    else:
+        message = email.message_from_string(raw_email)
+        original = raw_email
 
-    message = email.message_from_string(raw_email)
-    maintype = message.get_content_maintype()
+    return parse_message(message, original)
+
+
+def parse_email_stream(chunks, keep_original=True):
+    """
+    Parse a raw message from an iterable of bytes chunks.
+
+    This is a standalone API for callers that read a message incrementally
+    (e.g from a file or socket), the IMAP transport doesn't use it since
+    IMAPClient returns every fetched literal as one bytes object.
+
+    The chunks are fed to the parser as they come, without being kept
+    around. With `keep_original` they're appended to a single buffer that
+    is dropped once decoded into ``original``. Without it the result has an
+    empty ``original``, so that no second copy of the message is kept.
+    """
+    parser = BytesFeedParser()
+    buffer = bytearray() if keep_original else None
+
+    for chunk in chunks:
+        parser.feed(chunk)
 
-    parsed_email = {'original': raw_email}
+        if buffer is not None:
+            buffer += chunk
 
+    message = parser.close()
+
+    original = ''
+    if buffer is not None:
+        original = decode_bytes(buffer)
+        del buffer
+
+    return parse_message(message, original)
+
+
+def parse_message(message, original):
+    """
+    Turn an `email.message.Message` into the `parse_email` result.
+    """
+    return ParsedEmail(message, original)
+
+
+def get_text_parts(message):
+    """
+    Yield the non-attachment text parts of a multipart message.
+    """
+    for part in message.walk():
+        content_type = part.get_content_type()
+        content_disposition = part.get('Content-Disposition', None)
+        is_inline = content_disposition is None or content_disposition == 'inline'
+
+        if content_type in ('text/plain', 'text/html') and is_inline:
+            yield part
+
+
+def parse_body(message):
     body = {
         'plain': [],
         'html': []
     }
-    attachments = []
 
-    if maintype in ('multipart', 'image'):
-        for part in message.walk():
-            content_type = part.get_content_type()
-            part_maintype = part.get_content_maintype()
-            content_disposition = part.get('Content-Disposition', None)
+    maintype = message.get_content_maintype()
 
-            if content_disposition or not part_maintype == 'text':
+    if maintype in ('multipart', 'image'):
+        for part in get_text_parts(message):
+            if part.get('Content-Disposition', None):
                 content = part.get_payload(decode=True)
             else:
                 content = decode_content(part)
 
-            is_inline = content_disposition is None or content_disposition == 'inline'
-
-            if content_type == 'text/plain' and is_inline:
-                body['plain'].append(content)
-            elif content_type == 'text/html' and is_inline:
-                body['html'].append(content)
-            elif content_disposition:
-                attachment = parse_attachment(part)
-                if attachment:
-                    attachments.append(attachment)
+            body['plain' if part.get_content_type() == 'text/plain' else 'html'].append(content)
 
     elif maintype == 'text':
-        payload = decode_content(message)
-        body['plain'].append(payload)
+        body['plain'].append(decode_content(message))
+
+    return body
+
+
+def parse_attachments(message):
+    if message.get_content_maintype() not in ('multipart', 'image'):
+        return []
+
+    text_parts = {id(part) for part in get_text_parts(message)}
+    attachments = []
+
+    for part in message.walk():
+        if id(part) not in text_parts and part.get('Content-Disposition', None):
+            attachment = parse_attachment(part)
+            if attachment:
+                attachments.append(attachment)
 
-    parsed_email['attachments'] = attachments
+    return attachments
 
-    parsed_email['body'] = body
-    email_dict = dict(message.items())
+
+class ParsedEmail(MutableMapping):
+    """
+    The result of `parse_email`, a dict that decodes lazily.
+
+    Headers and addresses are parsed right away, ``body`` and
+    ``attachments`` are only decoded on first access and then cached.
+    """
+    lazy_keys = {
+        'body': parse_body,
+        'attachments': parse_attachments,
+    }
+
+    def __init__(self, message, original):
+        self.message = message
+        self._data = {'original': original}
+        self._data.update(parse_header_fields(message))
+        self._pending = set(self.lazy_keys)
+
+    def _load(self, key):
+        if key in self._pending:
+            self._data[key] = self.lazy_keys[key](self.message)
+            self._pending.discard(key)
+
+    def __getitem__(self, key):
+        self._load(key)
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._pending.discard(key)
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        if key in self._pending:
+            self._pending.discard(key)
+        else:
+            del self._data[key]
+
+    def __contains__(self, key):
+        # Without decoding anything
+        return key in self._data or key in self._pending
+
+    def __iter__(self):
+        yield from self._data
+        yield from [key for key in self.lazy_keys if key in self._pending]
+
+    def __len__(self):
+        return len(self._data) + len(self._pending)
+
+    def __repr__(self):
+        return f'<ParsedEmail({self._data.get("subject", "")!r})>'
+
+
+def parse_headers(raw_email):
+    """
+    Parse only the headers of a raw message, either bytes or a string.
+
+    Returns the header fields of the `parse_email` result (addresses,
+    subject, date, message id and ``headers``), the body isn't parsed.
+    """
+    if isinstance(raw_email, bytes):
+        match = RE_HEADER_END_BYTES.search(raw_email)
+        message = BytesHeaderParser().parsebytes(
+            raw_email[:match.end()] if match else raw_email)
+    else:
+        match = RE_HEADER_END.search(raw_email)
+        message = HeaderParser().parsestr(
+            raw_email[:match.end()] if match else raw_email)
+
+    return parse_header_fields(message)
+
+
+def parse_header_fields(message):
+    parsed_email = {}
+    email_dict = dict(get_headers(message))
 
     parsed_email['from'] = get_mail_addresses(message, 'from')
     parsed_email['to'] = get_mail_addresses(message, 'to')
@@ -189,6 +417,12 @@ def parse_email(raw_email):
             parsed_email['headers'][key.lower()] = value
 
     if parsed_email.get('date'):
-        parsed_email['parsed_date'] = email.utils.parsedate_to_datetime(parsed_email['date'])
+        try:
+            parsed_email['parsed_date'] = email.utils.parsedate_to_datetime(
+                parsed_email['date'])
+        except (TypeError, ValueError, IndexError, OverflowError):
+            # Malformed dates are common in spam, callers fall back to
+            # e.g the INTERNALDATE of the message.
+            pass
 
     return parsed_email
@@ -1,8 +1,15 @@
 import json
 
+from imapclient.response_parser import parse_fetch_response
 from rest_framework.test import APIClient as BaseAPIClient
 
 
+def parse_bodystructure(value):
+    """Parse a raw BODYSTRUCTURE just like `IMAPClient.fetch` does."""
+    response = parse_fetch_response([b'1 (UID 1 BODYSTRUCTURE ' + value + b')'], True)
+    return response[1][b'BODYSTRUCTURE']
+
+
 class APIClient(BaseAPIClient):
     """
     Subclass to handle our custom accept headers required
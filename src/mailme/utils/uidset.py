@@ -0,0 +1,195 @@
+from array import array
+from bisect import bisect_right
+
+from django.utils.encoding import force_text
+
+
+class UidSet(object):
+    """A set of IMAP UIDs stored as sorted, non-overlapping ranges.
+
+    Mailbox folders tend to have long runs of consecutive UIDs, storing
+    them as ranges in two integer arrays keeps the set small and set
+    operations fast even for millions of UIDs. Sets can be parsed from
+    and serialized to IMAP sequence sets directly.
+
+    .. code:: python
+
+        >>> uids = UidSet([1, 2, 3, 4, 5, 10, 12, 13])
+        >>> uids
+        <UidSet(1:5,10,12:13)>
+        >>> list(uids - UidSet.from_sequence('2:3,12'))
+        [1, 4, 5, 10, 13]
+
+    """
+    __slots__ = ('_starts', '_ends')
+
+    def __init__(self, uids=()):
+        self._starts = array('q')
+        self._ends = array('q')
+
+        if isinstance(uids, UidSet):
+            self._starts.extend(uids._starts)
+            self._ends.extend(uids._ends)
+            return
+
+        for uid in sorted(set(map(int, uids))):
+            self._append(uid, uid)
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """Create a set from ``(start, end)`` pairs in any order."""
+        instance = cls()
+
+        for start, end in sorted((min(r), max(r)) for r in ranges):
+            instance._append(start, end)
+
+        return instance
+
+    @classmethod
+    def from_sequence(cls, value):
+        """Parse an IMAP sequence set like ``b'1:3,7'``."""
+        value = force_text(value).strip()
+
+        if not value:
+            return cls()
+
+        ranges = []
+        for item in value.split(','):
+            start, _, end = item.partition(':')
+            ranges.append((int(start), int(end or start)))
+
+        return cls.from_ranges(ranges)
+
+    def _append(self, start, end):
+        # Ranges have to be appended in order, overlapping or adjacent
+        # ranges are merged.
+        if self._ends and start <= self._ends[-1] + 1:
+            self._ends[-1] = max(self._ends[-1], end)
+        else:
+            self._starts.append(start)
+            self._ends.append(end)
+
+    def ranges(self):
+        return list(zip(self._starts, self._ends))
+
+    @property
+    def min(self):
+        if not self:
+            raise ValueError('min() of an empty UidSet')
+        return self._starts[0]
+
+    @property
+    def max(self):
+        if not self:
+            raise ValueError('max() of an empty UidSet')
+        return self._ends[-1]
+
+    def __iter__(self):
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end + 1)
+
+    def __reversed__(self):
+        for start, end in zip(reversed(self._starts), reversed(self._ends)):
+            yield from range(end, start - 1, -1)
+
+    def __len__(self):
+        return sum(self._ends) - sum(self._starts) + len(self._starts)
+
+    def __bool__(self):
+        return bool(self._starts)
+
+    def __contains__(self, uid):
+        index = bisect_right(self._starts, uid) - 1
+        return index >= 0 and uid <= self._ends[index]
+
+    def __eq__(self, other):
+        if not isinstance(other, UidSet):
+            return NotImplemented
+        return self._starts == other._starts and self._ends == other._ends
+
+    __hash__ = None
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def union(self, other):
+        """Return the UIDs that are in this set, `other` or both."""
+        result = UidSet()
+        ranges, other_ranges = self.ranges(), other.ranges()
+        index = other_index = 0
+
+        while index < len(ranges) or other_index < len(other_ranges):
+            take_own = other_index >= len(other_ranges) or (
+                index < len(ranges) and
+                ranges[index][0] <= other_ranges[other_index][0])
+
+            if take_own:
+                result._append(*ranges[index])
+                index += 1
+            else:
+                result._append(*other_ranges[other_index])
+                other_index += 1
+
+        return result
+
+    def difference(self, other):
+        """Return the UIDs of this set that are not in `other`."""
+        result = UidSet()
+        other_ranges = other.ranges()
+        index = 0
+
+        for start, end in self.ranges():
+            # Skip ranges of `other` that end before this range starts
+            while index < len(other_ranges) and other_ranges[index][1] < start:
+                index += 1
+
+            position = index
+            while position < len(other_ranges) and other_ranges[position][0] <= end:
+                other_start, other_end = other_ranges[position]
+
+                if other_start > start:
+                    result._append(start, other_start - 1)
+
+                start = max(start, other_end + 1)
+                position += 1
+
+            if start <= end:
+                result._append(start, end)
+
+        return result
+
+    def intersection(self, other):
+        """Return the UIDs that are in both this set and `other`."""
+        result = UidSet()
+        ranges, other_ranges = self.ranges(), other.ranges()
+        index = other_index = 0
+
+        while index < len(ranges) and other_index < len(other_ranges):
+            start = max(ranges[index][0], other_ranges[other_index][0])
+            end = min(ranges[index][1], other_ranges[other_index][1])
+
+            if start <= end:
+                result._append(start, end)
+
+            # Advance whichever range ends first
+            if ranges[index][1] < other_ranges[other_index][1]:
+                index += 1
+            else:
+                other_index += 1
+
+        return result
+
+    def __str__(self):
+        """Serialize to the shortest IMAP sequence set, e.g ``1:5,10``."""
+        return ','.join(
+            str(start) if start == end else f'{start}:{end}'
+            for start, end in zip(self._starts, self._ends))
+
+    def __repr__(self):
+        return f'<UidSet({self})>'